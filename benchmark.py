@@ -0,0 +1,246 @@
+# benchmark.py
+# Pruebas de carga de extremo a extremo sin Telegram ni Gemini reales.
+#
+#   python benchmark.py registrations --players 5000 --duration 60
+#   python benchmark.py tournament --players 1024 --time-scale 0.001
+#   python benchmark.py tournament --players 256 --channels 4
+#
+# Los manejadores de bot.py se llaman directamente con actualizaciones simuladas,
+# contra un bot y un modelo de Gemini falsos con latencia y fallos configurables,
+# y sobre una base de datos temporal.
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+import types
+from itertools import count
+
+from telegram.error import RetryAfter
+
+import bot
+import config
+import database
+import metrics
+
+class FakeBot:
+    """Sustituto de la API de Bot de Telegram: latencia aleatoria y algún RetryAfter."""
+    def __init__(self, latency=0.03, retry_after_rate=0.0, retry_after=1.0, seed=0):
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._message_ids = count(1)
+
+    async def _request(self, chat_id, flood_control=True):
+        self.calls += 1
+        await asyncio.sleep(self._rng.uniform(0.5, 1.5) * self.latency)
+        if flood_control and self._rng.random() < self.retry_after_rate:
+            raise RetryAfter(self.retry_after)
+        return types.SimpleNamespace(chat_id=chat_id, message_id=next(self._message_ids))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._request(chat_id)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._request(chat_id)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return [await self._request(chat_id) for _ in media]
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return await self._request(chat_id)
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        return await self._request(chat_id)
+
+    async def unpin_chat_message(self, chat_id, message_id, **kwargs):
+        return await self._request(chat_id)
+
+class FakeGenerativeModel:
+    """Sustituto de `genai.GenerativeModel`: responde con latencia configurable y falla con la tasa indicada."""
+    def __init__(self, latency=1.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        self.calls += 1
+        await asyncio.sleep(self._rng.uniform(0.5, 1.5) * self.latency)
+        if self._rng.random() < self.failure_rate:
+            raise RuntimeError("fallo simulado de Gemini")
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            fights = len(re.findall(r"^Combate \d+ —", prompt, flags=re.MULTILINE))
+            text = json.dumps([{"combate": n, "narracion": f"Narración simulada del combate {n}."} for n in range(1, fights + 1)])
+        else:
+            text = "Narración simulada del combate."
+        return types.SimpleNamespace(text=text)
+
+class FakeMessage:
+    def __init__(self, user_id, fake_bot, photo=None):
+        self.from_user = types.SimpleNamespace(id=user_id, username=f"guerrero{user_id}")
+        self.photo = photo or []
+        self._bot = fake_bot
+
+    async def reply_text(self, text, **kwargs):
+        # Las respuestas directas no pasan por las colas con reintento: no se les inyecta RetryAfter.
+        return await self._bot._request(self.from_user.id, flood_control=False)
+
+def fake_update(message):
+    return types.SimpleNamespace(message=message, effective_user=message.from_user)
+
+def fake_context(application, args=None, user_data=None):
+    return types.SimpleNamespace(args=args or [], user_data=user_data if user_data is not None else {},
+                                 chat_data={}, application=application, bot=application.bot)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def peak_memory_mb():
+    """Memoria residente máxima del proceso (Linux informa en KiB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def timed_call(latencies, name, coro):
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+async def start_bot(args):
+    """Arranca el bot contra los sustitutos, con las pausas y límites de ritmo comprimidos."""
+    database.DB_NAME = os.path.join(args.workdir, "benchmark.db")
+    bot.TIME_SCALE = args.time_scale
+    bot.metrics_writer = None
+    config.GEMINI_API_KEY = None
+    fake_bot = FakeBot(args.telegram_latency * args.time_scale, args.retry_after_rate, args.time_scale, seed=args.seed)
+    application = types.SimpleNamespace(bot=fake_bot, create_task=asyncio.create_task)
+    await bot.on_startup(application)
+    # Todos los torneos comparten el mismo modelo simulado, como comparten Gemini.
+    model = FakeGenerativeModel(args.gemini_latency * args.time_scale, args.gemini_failure_rate, seed=args.seed)
+    outboxes = [bot.admin_outbox, bot.dm_outbox]
+    for channel_id in channel_ids(args):
+        tournament = bot.scheduler.get(channel_id)
+        tournament.game.model = model
+        tournament.game.narration_timeout = bot.NARRATION_TIMEOUT * args.time_scale
+        tournament.game.template_cooldown = bot.NARRATION_TEMPLATE_COOLDOWN * args.time_scale
+        outboxes.append(tournament.outbox)
+    for outbox in outboxes:
+        outbox.rate /= args.time_scale
+    bot.telegram_limiter.rate /= args.time_scale
+    return application, model
+
+def channel_ids(args):
+    return [bot.CHANNEL_ID - index for index in range(args.channels)]
+
+async def run_registrations(application, model, args):
+    """Inscripciones repartidas uniformemente en `duration` segundos (escalados)."""
+    admin = FakeMessage(bot.ADMIN_CHAT_ID, application.bot)
+    await bot.abrir_convocatoria(fake_update(admin), fake_context(application))
+    latencies = {}
+    gap = args.duration * args.time_scale / args.players
+
+    async def register(user_id):
+        user_data = {}
+        message = FakeMessage(user_id, application.bot)
+        context = fake_context(application, args=[f"Guerrero {user_id}", "|", "Dominio"], user_data=user_data)
+        await timed_call(latencies, "invocacion_start", bot.invocacion_start(fake_update(message), context))
+        message = FakeMessage(user_id, application.bot, photo=[types.SimpleNamespace(file_id=f"foto{user_id}")])
+        context = fake_context(application, user_data=user_data)
+        await timed_call(latencies, "get_evidence_image", bot.get_evidence_image(fake_update(message), context))
+
+    start = time.perf_counter()
+    tasks = []
+    for user_id in range(1, args.players + 1):
+        tasks.append(asyncio.create_task(register(user_id)))
+        await asyncio.sleep(gap)
+    await asyncio.gather(*tasks)
+    # Espera a que el último lote de inscripciones llegue a SQLite.
+    while await database.count_pending_players() < args.players and time.perf_counter() - start < 60:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    saved = await database.count_pending_players()
+    return {"inscripciones guardadas": saved, "segundos": elapsed, "inscripciones/s": saved / elapsed}, latencies
+
+async def run_tournament(application, model, args):
+    """Un torneo completo por canal, todos a la vez, con `players` guerreros aprobados cada uno (uno de cada 20 campeón)."""
+    for channel_id in channel_ids(args):
+        await database.clear_players(channel_id)
+        await database.add_player_submissions([(channel_id, user_id, f"guerrero{user_id}", f"Guerrero {user_id}", "Dominio",
+                                                bot.ABSURD_SKILLS[user_id % len(bot.ABSURD_SKILLS)], None)
+                                               for user_id in range(1, args.players + 1)])
+        await database.approve_players([(channel_id, user_id) for user_id in range(1, args.players + 1) if user_id % 20], is_champion=False)
+        await database.approve_players([(channel_id, user_id) for user_id in range(20, args.players + 1, 20)], is_champion=True)
+    metrics.reset()
+
+    admin = FakeMessage(bot.ADMIN_CHAT_ID, application.bot)
+    latencies = {}
+    start = time.perf_counter()
+    for channel_id in channel_ids(args):
+        await timed_call(latencies, "accion_command", bot.accion_command(fake_update(admin), fake_context(application, args=[str(channel_id), str(args.seed)])))
+    durations = {}
+
+    async def finish(tournament):
+        await tournament.task
+        durations[tournament.channel_id] = time.perf_counter() - start
+
+    await asyncio.gather(*(finish(bot.scheduler.get(channel_id)) for channel_id in channel_ids(args)))
+    elapsed = time.perf_counter() - start
+
+    fights = metrics.counter_total("narrations_total")
+    report = {"combates": fights, "segundos": elapsed, "combates/s": fights / elapsed, "llamadas a Gemini": model.calls,
+              "narraciones por plantilla": metrics.counter_total("narrations_total", source="template")}
+    waits = metrics.histogram("tournament_phase_seconds", phase="narration_wait")
+    if waits:
+        counts, _, total = waits
+        report["espera de narración p50 (s)"] = metrics.quantile(counts, total, 0.5)
+        report["espera de narración p99 (s)"] = metrics.quantile(counts, total, 0.99)
+    if len(durations) > 1:
+        # Con un reparto justo, los torneos simultáneos terminan a la vez.
+        report["torneo más rápido (s)"] = min(durations.values())
+        report["torneo más lento (s)"] = max(durations.values())
+    return report, latencies
+
+async def main(args):
+    application, model = await start_bot(args)
+    try:
+        scenario = run_registrations if args.scenario == "registrations" else run_tournament
+        report, latencies = await scenario(application, model, args)
+    finally:
+        await bot.on_shutdown(application)
+
+    print(f"Escenario: {args.scenario} ({args.players} guerreros, {args.channels} canal(es), escala de tiempo {args.time_scale})")
+    for name, value in report.items():
+        print(f"  {name}: {value:.3f}" if isinstance(value, float) else f"  {name}: {value}")
+    for name, values in sorted(latencies.items()):
+        print(f"  {name}: n={len(values)} p50={percentile(values, 0.5) * 1000:.2f}ms p99={percentile(values, 0.99) * 1000:.2f}ms")
+    print(f"  llamadas a Telegram: {application.bot.calls}")
+    print(f"  memoria máxima: {peak_memory_mb():.1f} MiB")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pruebas de carga del Coliseo con Telegram y Gemini simulados.")
+    parser.add_argument("scenario", choices=["registrations", "tournament"])
+    parser.add_argument("--players", type=int, default=None, help="Guerreros (5000 inscripciones / 1024 en el torneo por defecto).")
+    parser.add_argument("--channels", type=int, default=1, help="Torneos simultáneos, uno por canal (escenario tournament).")
+    parser.add_argument("--duration", type=float, default=60, help="Segundos en los que llegan las inscripciones (antes de escalar).")
+    parser.add_argument("--time-scale", type=float, default=0.001, help="Factor aplicado a pausas, límites de ritmo y latencias simuladas.")
+    parser.add_argument("--telegram-latency", type=float, default=0.1, help="Latencia media de la API de Telegram (s, antes de escalar).")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Probabilidad de que Telegram responda RetryAfter.")
+    parser.add_argument("--gemini-latency", type=float, default=3.0, help="Latencia media de Gemini (s, antes de escalar).")
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="Probabilidad de que una llamada a Gemini falle.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.players is None:
+        args.players = 5000 if args.scenario == "registrations" else 1024
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        asyncio.run(main(args))
@@ -1,30 +1,123 @@
 # bot.py
 import asyncio
+import functools
+import json
 import random
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+import signal
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
 from telegram.constants import ParseMode
 
 import config
 import database
-from game import Game, ABSURD_SKILLS
+import metrics
+from game import Game, CombatPrefetcher, ABSURD_SKILLS
+from outbox import Outbox, split_lines
+from checkpoint import CheckpointWriter
+from registration import RegistrationIngestor
+from narration import NarrationCache
+from webhook import WebhookServer
+from scheduler import FairRateLimiter, FairSemaphore, TournamentScheduler
 
 # --- CONFIGURACIÓN ---
 ADMIN_CHAT_ID = 1890046858
-CHANNEL_ID = -1003186635788
+CHANNEL_ID = -1003186635788    # Canal por defecto; los comandos de admin aceptan otro id de canal como primer argumento
 BOT_USERNAME = "Coliseo_Shitsumon_Kai_bot"
+NARRATION_TIMEOUT = 30          # Presupuesto de latencia de Gemini: pasado este tiempo narra el motor local
+NARRATION_FAILURE_THRESHOLD = 3 # Fallos seguidos de Gemini antes de pasar solo a plantillas
+NARRATION_TEMPLATE_COOLDOWN = 300 # Segundos que se usan solo plantillas tras esos fallos
+NARRATION_CACHE_SIZE = 5000     # Narraciones guardadas (se expulsan las menos usadas)
+MAX_CONCURRENT_NARRATIONS = 4   # Llamadas simultáneas a Gemini como máximo por torneo
+GEMINI_CONCURRENCY = 6          # Llamadas simultáneas a Gemini entre todos los torneos (repartidas por turnos)
+NARRATION_PREFETCH_DEPTH = 2    # Combates que se narran por adelantado durante las cuentas atrás
+BATCH_NARRATION = True          # Narrar los combates de una ronda en lotes (una llamada por lote)
+NARRATION_TOKEN_BUDGET = 4000   # Tokens aproximados por petición en el modo por lotes
+CHANNEL_MESSAGES_PER_MINUTE = 20 # Límite de Telegram para grupos y canales
+CHANNEL_BURST = 3               # Mensajes que pueden salir seguidos antes de aplicar el límite
+ARENAS = 4                      # Combates de una misma ronda que se disputan a la vez (1 = uno tras otro)
+CHECKPOINT_INTERVAL = 2.0       # Segundos entre escrituras por lotes de los combates terminados
+REGISTRATION_BATCH_INTERVAL = 0.02 # Segundos que se acumulan inscripciones antes de guardarlas juntas
+REVIEW_PAGE_SIZE = 10           # Solicitudes por página de revisión (máximo de un grupo de fotos)
+SEEDED_PAIRINGS = False         # Emparejar por puntuación Elo (mejor contra peor) en vez de al azar
+LEADERBOARD_SIZE = 10           # Puestos que muestra /clasificacion por defecto
+LEADERBOARD_MAX_SIZE = 100      # Puestos máximos que se pueden pedir a /clasificacion
+ADMIN_MESSAGES_PER_MINUTE = 30  # Ritmo de mensajes al chat del administrador
+DM_MESSAGES_PER_MINUTE = 1500   # Avisos privados a los guerreros (~25/s, bajo el límite global de Telegram)
+DM_BURST = 25
+BOT_MESSAGES_PER_SECOND = 30    # Límite global de Telegram para todo el bot, repartido por turnos entre colas
+WEBHOOK_URL = None              # URL pública (https://...) para recibir actualizaciones por webhook; None = sondeo
+WEBHOOK_PATH = "telegram"       # Ruta local donde llegan las actualizaciones
+WEBHOOK_SECRET_TOKEN = None     # Telegram lo envía en X-Telegram-Bot-Api-Secret-Token; None = uno aleatorio en cada arranque
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8080             # Puerto local, detrás del proxy que termina el TLS
+METRICS_FILE = "coliseum.prom"  # Métricas en formato Prometheus (recolector textfile); None para no escribirlas
+METRICS_INTERVAL = 15           # Segundos entre volcados del fichero de métricas
+WEBHOOK_SERVE_METRICS = False   # Servir también GET /metrics en el puerto del webhook (sin autenticación)
+TIME_SCALE = 1.0                # Factor de las cuentas atrás y pausas del torneo (las pruebas de carga lo reducen)
 
 # --- ESTADOS PARA LA CONVERSACIÓN ---
 GET_EVIDENCE = range(1)
 
 # --- INSTANCIAS ---
-game = Game(config.GEMINI_API_KEY)
-database.initialize_db()
+narration_cache = NarrationCache(capacity=NARRATION_CACHE_SIZE)
+gemini_slots = FairSemaphore(GEMINI_CONCURRENCY)
+telegram_limiter = FairRateLimiter(BOT_MESSAGES_PER_SECOND, burst=BOT_MESSAGES_PER_SECOND)
+checkpoints = CheckpointWriter(interval=CHECKPOINT_INTERVAL)
+admin_outbox = Outbox(ADMIN_CHAT_ID, messages_per_minute=ADMIN_MESSAGES_PER_MINUTE, burst=CHANNEL_BURST, shared_limiter=telegram_limiter)
+dm_outbox = Outbox(messages_per_minute=DM_MESSAGES_PER_MINUTE, burst=DM_BURST, shared_limiter=telegram_limiter)
+metrics_writer = metrics.PrometheusFileWriter(METRICS_FILE, METRICS_INTERVAL) if METRICS_FILE else None
+registrations = RegistrationIngestor(interval=REGISTRATION_BATCH_INTERVAL, on_flush=lambda count: refresh_pending_notice())
+pending_notice = None  # Futuro con el aviso de solicitudes pendientes en el chat del admin
+
+# --- TEXTOS PARA LOS GUERREROS ---
+ASPIRANT_APPROVED_TEXT = "¡Kai ha aceptado tu ofrenda! Has sido invocado como un Aspirante."
+CHAMPION_APPROVED_TEXT = "¡Kai te reconoce como un Campeón! Ocupa tu lugar de honor."
+REJECTED_TEXT = "Tu ofrenda no ha sido suficiente. Tu alma ha sido devuelta."
+
+# Se activa cuando el calentamiento en segundo plano termina (lo consulta GET /ready).
+bot_ready = asyncio.Event()
+background_tasks = set()  # Referencias a tareas sueltas para que no las recoja el recolector de basura
+
+# --- TORNEOS POR CANAL ---
+
+def create_game(channel_id):
+    """Estado propio de un torneo; Gemini y la caché de narraciones se comparten con los demás."""
+    game = Game(config.GEMINI_API_KEY, narration_timeout=NARRATION_TIMEOUT, batch_narration=BATCH_NARRATION,
+                narration_token_budget=NARRATION_TOKEN_BUDGET, narration_cache=narration_cache,
+                failure_threshold=NARRATION_FAILURE_THRESHOLD, template_cooldown=NARRATION_TEMPLATE_COOLDOWN,
+                narration_slots=gemini_slots.tenant(channel_id, MAX_CONCURRENT_NARRATIONS),
+                seeded_pairings=SEEDED_PAIRINGS)
+    if bot_ready.is_set():
+        # Creado tras el calentamiento: Gemini ya está importado, configurarlo es inmediato.
+        task = asyncio.create_task(game.warm_up())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return game
+
+def create_channel_outbox(channel_id):
+    return Outbox(channel_id, messages_per_minute=CHANNEL_MESSAGES_PER_MINUTE, burst=CHANNEL_BURST, shared_limiter=telegram_limiter)
+
+scheduler = TournamentScheduler(create_game, create_channel_outbox)
+
+def _split_channel_arg(args):
+    """Separa un id de canal opcional (negativo, p. ej. -100123...) del resto de argumentos."""
+    if args and args[0].startswith('-') and args[0][1:].isdigit():
+        return int(args[0]), args[1:]
+    return CHANNEL_ID, list(args or [])
 
 # --- COMANDOS ---
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Da la bienvenida y explica cómo inscribirse."""
+    """Da la bienvenida y explica cómo inscribirse. `/start <canal>` (enlace del anuncio) elige la convocatoria."""
+    if context.args and context.args[0].lstrip('-').isdigit():
+        channel_id = int(context.args[0])
+        tournament = scheduler.find(channel_id)
+        if tournament and tournament.game.is_invocation_open:
+            context.user_data['channel_id'] = channel_id
+            await update.message.reply_text("Te inscribirás en la convocatoria de ese canal. Usa `/invocacion <Tu Nombre de Guerrero> | <Tu Dominio de Combate>`.",
+                                            parse_mode=ParseMode.MARKDOWN)
+            return
     await update.message.reply_text(
         "Saludos, guerrero. Soy el Heraldo de Kai. Si las puertas del Templo están abiertas, "
         "puedes unirte al torneo con el comando: \n\n"
@@ -33,39 +126,83 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN
     )
 
+@metrics.handler
 async def abrir_convocatoria(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Admin: Anuncia la apertura de inscripciones en el canal."""
+    """Admin: Anuncia la apertura de inscripciones en un canal (`/abrir_convocatoria [canal]`)."""
     if update.message.from_user.id != ADMIN_CHAT_ID: return
+    channel_id, _ = _split_channel_arg(context.args)
+    tournament = scheduler.get(channel_id)
+    if tournament.game.is_running:
+        await update.message.reply_text("Ese canal tiene un torneo en curso.")
+        return
     
-    database.clear_all_players()
-    game.end_game()
-    game.is_invocation_open = True
+    # Solo se vacía la convocatoria de este canal: los demás torneos no se tocan.
+    await database.clear_players(channel_id)
+    registrations.reset(channel_id)
+    tournament.game.end_game()
+    tournament.game.is_invocation_open = True
     
     announcement_text = (
         f"⚔️ **¡LA CONVOCATORIA HA COMENZADO!** ⚔️\n\n"
         f"Guerreros, la arena os espera. Para forjar vuestra leyenda, "
-        f"iniciad una conversación con nuestro heraldo (`@{BOT_USERNAME}`) "
+        # Enlace en línea: los guiones bajos del nombre del bot romperían el Markdown en texto plano.
+        f"iniciad una conversación con [nuestro heraldo](https://t.me/{BOT_USERNAME}?start={channel_id}) "
         f"y usad el comando `/invocacion` para registraros."
     )
     
-    await context.bot.send_message(
-        chat_id=CHANNEL_ID,
-        text=announcement_text,
-        parse_mode=ParseMode.MARKDOWN
-    )
+    await tournament.outbox.send(announcement_text, parse_mode=ParseMode.MARKDOWN)
     await update.message.reply_text("Anuncio de convocatoria publicado en el canal.")
 
-# --- FLUJO DE INSCRIPCIÓN POR COMANDOS ---
+# --- FLUJO DE INSCRIPCIÓN (COMANDO O WEBAPP) ---
 
-async def invocacion_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Paso 1: Recibe el comando de inscripción y los datos."""
-    if not game.is_invocation_open:
-        await update.message.reply_text("Las puertas del Templo están cerradas. No puedes inscribirte ahora.")
+async def _begin_submission(update: Update, context: ContextTypes.DEFAULT_TYPE, channel_id, character_name, specialty):
+    """Guarda los datos del guerrero y pide la imagen de evidencia."""
+    if not character_name or not specialty:
+        await update.message.reply_text("Debes proporcionar un nombre y un dominio.")
         return ConversationHandler.END
 
     user = update.message.from_user
-    if database.player_exists(user.id):
+    # Guardar datos temporalmente para el siguiente paso
+    context.user_data['submission'] = {
+        'channel_id': channel_id,
+        'user_id': user.id,
+        'user_name': user.username,
+        'character_name': character_name,
+        'specialty': specialty
+    }
+
+    await update.message.reply_text(
+        f"Guerrero '{character_name}' registrado. Para completar tu invocación, **envía ahora la imagen de evidencia** en este chat."
+    )
+    return GET_EVIDENCE
+
+async def _check_can_register(update: Update, context: ContextTypes.DEFAULT_TYPE, channel_id=None):
+    """Elige la convocatoria y comprueba que está abierta y que el usuario no está ya inscrito en ella.
+
+    Devuelve el id del canal, o None si no puede inscribirse.
+    """
+    channel_id = channel_id or context.user_data.get('channel_id')
+    if channel_id is None:
+        # Sin enlace del anuncio: vale si solo hay una convocatoria abierta.
+        open_tournaments = scheduler.open_invocations()
+        if len(open_tournaments) > 1:
+            await update.message.reply_text("Hay varias convocatorias abiertas. Entra con el enlace del anuncio del canal en el que quieras combatir.")
+            return None
+        channel_id = open_tournaments[0].channel_id if open_tournaments else CHANNEL_ID
+    tournament = scheduler.find(channel_id)
+    if tournament is None or not tournament.game.is_invocation_open:
+        await update.message.reply_text("Las puertas del Templo están cerradas. No puedes inscribirte ahora.")
+        return None
+    if registrations.is_known(channel_id, update.message.from_user.id):
         await update.message.reply_text("Ya tienes una solicitud en proceso o has sido aceptado.")
+        return None
+    return channel_id
+
+@metrics.handler
+async def invocacion_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Paso 1: Recibe el comando de inscripción y los datos."""
+    channel_id = await _check_can_register(update, context)
+    if channel_id is None:
         return ConversationHandler.END
 
     try:
@@ -75,28 +212,31 @@ async def invocacion_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
             
         character_name, specialty = [part.strip() for part in args_text.split('|', 1)]
-        if not character_name or not specialty:
-            await update.message.reply_text("Debes proporcionar un nombre y un dominio.")
-            return ConversationHandler.END
-
-        # Guardar datos temporalmente para el siguiente paso
-        context.user_data['submission'] = {
-            'user_id': user.id,
-            'user_name': user.username,
-            'character_name': character_name,
-            'specialty': specialty
-        }
-
-        await update.message.reply_text(
-            f"Guerrero '{character_name}' registrado. Para completar tu invocación, **envía ahora la imagen de evidencia** en este chat."
-        )
-        return GET_EVIDENCE
+        return await _begin_submission(update, context, channel_id, character_name, specialty)
 
     except Exception as e:
         await update.message.reply_text("Ha ocurrido un error al procesar tu solicitud. Inténtalo de nuevo.")
         print(f"Error en invocacion_start: {e}")
         return ConversationHandler.END
 
+@metrics.handler
+async def invocacion_webapp(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Paso 1 (WebApp): Recibe los datos enviados con `tg.sendData` desde el formulario (con `channel_id` opcional)."""
+    try:
+        data = json.loads(update.message.web_app_data.data)
+        character_name = str(data.get('character_name', '')).strip()
+        specialty = str(data.get('specialty', '')).strip()
+        requested_channel = int(data['channel_id']) if data.get('channel_id') else None
+    except (ValueError, TypeError, AttributeError) as e:
+        await update.message.reply_text("Los datos del formulario no son válidos. Inténtalo de nuevo.")
+        print(f"Error en invocacion_webapp: {e}")
+        return ConversationHandler.END
+    channel_id = await _check_can_register(update, context, requested_channel)
+    if channel_id is None:
+        return ConversationHandler.END
+    return await _begin_submission(update, context, channel_id, character_name, specialty)
+
+@metrics.handler
 async def get_evidence_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Paso 2: Recibe la foto y la envía al admin para aprobación."""
     submission_data = context.user_data.get('submission')
@@ -107,28 +247,23 @@ async def get_evidence_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = submission_data['user_id']
     absurd_skill = random.choice(ABSURD_SKILLS)
     
-    database.add_player_submission(user_id, submission_data['user_name'], submission_data['character_name'], submission_data['specialty'], absurd_skill)
-    
-    caption = (f"**Nueva Solicitud**\n\n"
-               f"**Usuario:** @{submission_data['user_name']} (`{user_id}`)\n"
-               f"**Guerrero:** {submission_data['character_name']}\n\n"
-               f"¿Cómo deseas clasificar a este guerrero?")
-    
-    keyboard = [[InlineKeyboardButton("✅ Aprobar como Aspirante", callback_data=f"approve_aspirant_{user_id}"),
-                 InlineKeyboardButton("👑 Aprobar como Campeón", callback_data=f"approve_champion_{user_id}")],
-                [InlineKeyboardButton("❌ Rechazar", callback_data=f"reject_{user_id}")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    try:
-        await context.bot.send_photo(chat_id=ADMIN_CHAT_ID, photo=update.message.photo[-1].file_id, caption=caption, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-        await update.message.reply_text("Tu ofrenda ha sido enviada para su juicio. Recibirás un cuervo con la decisión final.")
-    except Exception as e:
-        print(f"ERROR AL ENVIAR NOTIFICACIÓN AL ADMIN: {e}")
-        await update.message.reply_text("Hubo un error al contactar al Templo. Por favor, inténtalo de nuevo más tarde.")
+    # La escritura se agrupa con las demás inscripciones recientes; no hace falta esperarla.
+    # El admin no recibe una foto por solicitud: la evidencia se revisa por páginas con /revision.
+    saved = registrations.submit(submission_data['channel_id'], user_id, submission_data['user_name'], submission_data['character_name'], submission_data['specialty'],
+                                 absurd_skill, evidence_file_id=update.message.photo[-1].file_id)
+    saved.add_done_callback(functools.partial(_on_submission_saved, context.application, user_id))
+    await update.message.reply_text("Tu ofrenda ha sido enviada para su juicio. Recibirás un cuervo con la decisión final.")
         
     context.user_data.clear()
     return ConversationHandler.END
 
+def _on_submission_saved(application, user_id, future):
+    """Avisa al usuario si su lote de inscripciones no pudo guardarse."""
+    if future.cancelled() or future.exception() is None:
+        return
+    application.create_task(application.bot.send_message(
+        chat_id=user_id, text="No se pudo guardar tu inscripción. Por favor, empieza de nuevo con /invocacion."))
+
 async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancela la conversación si el usuario se atasca."""
     context.user_data.clear()
@@ -136,6 +271,7 @@ async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     return ConversationHandler.END
 
 # (El resto de funciones como accion_command, handle_admin_decision, etc., no cambian y son necesarias)
+@metrics.handler
 async def handle_admin_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #... (código idéntico a la versión anterior)
     query = update.callback_query
@@ -143,78 +279,411 @@ async def handle_admin_decision(update: Update, context: ContextTypes.DEFAULT_TY
     parts = query.data.split('_')
     action = "_".join(parts[:-1])
     user_id = int(parts[-1])
-    player_info = database.get_player_info(user_id)
+    # Estos botones son anteriores a los torneos por canal: siempre se refieren al canal por defecto.
+    player_info = await database.get_player_info(CHANNEL_ID, user_id)
     if not player_info:
         await query.edit_message_caption(caption=f"Decisión ya procesada para el usuario {user_id}.", reply_markup=None)
         return
     character_name = player_info[0]
     if action == "approve_aspirant":
-        database.approve_player(user_id, is_champion=False)
+        await database.approve_player(CHANNEL_ID, user_id, is_champion=False)
         await query.edit_message_caption(caption=f"✅ APROBADO (Aspirante): {character_name}", reply_markup=None)
-        await context.bot.send_message(chat_id=user_id, text="¡Kai ha aceptado tu ofrenda! Has sido invocado como un Aspirante.")
+        dm_outbox.send(ASPIRANT_APPROVED_TEXT, chat_id=user_id)
     elif action == "approve_champion":
-        database.approve_player(user_id, is_champion=True)
+        await database.approve_player(CHANNEL_ID, user_id, is_champion=True)
         await query.edit_message_caption(caption=f"👑 APROBADO (Campeón): {character_name}", reply_markup=None)
-        await context.bot.send_message(chat_id=user_id, text="¡Kai te reconoce como un Campeón! Ocupa tu lugar de honor.")
+        dm_outbox.send(CHAMPION_APPROVED_TEXT, chat_id=user_id)
     elif action == "reject":
-        database.reject_player(user_id)
+        await database.reject_player(CHANNEL_ID, user_id)
+        registrations.forget(CHANNEL_ID, user_id)
         await query.edit_message_caption(caption=f"❌ RECHAZADO: {character_name}", reply_markup=None)
-        await context.bot.send_message(chat_id=user_id, text="Tu ofrenda no ha sido suficiente. Tu alma ha sido devuelta.")
+        dm_outbox.send(REJECTED_TEXT, chat_id=user_id)
+
+# --- COLA DE REVISIÓN POR PÁGINAS ---
+
+async def refresh_pending_notice():
+    """Crea o actualiza el único aviso de solicitudes pendientes en el chat del admin.
+
+    Nunca espera a Telegram: corre dentro del escritor de inscripciones, que no debe
+    detenerse mientras el aviso aguarda su turno en la cola del admin.
+    """
+    global pending_notice
+    count = await database.count_pending_players()
+    text = f"📥 Hay {count} solicitudes pendientes de juicio. Usa /revision para revisarlas."
+    if pending_notice is None or pending_notice.cancelled() or (pending_notice.done() and pending_notice.exception()):
+        pending_notice = admin_outbox.send(text)
+    elif pending_notice.done():
+        admin_outbox.edit(pending_notice.result(), text)
+    else:
+        # El aviso aún no ha salido: se edita en cuanto salga (las ediciones seguidas se fusionan).
+        pending_notice.add_done_callback(functools.partial(_edit_pending_notice, text))
+
+def _edit_pending_notice(text, future):
+    if not future.cancelled() and future.exception() is None:
+        admin_outbox.edit(future.result(), text)
+
+def _review_text(review):
+    return (f"📜 **Revisión — página {review['page'] + 1}** ({len(review['players'])} solicitudes)\n\n"
+            f"Marca guerreros para aprobarlos juntos, o aprueba la página entera como Aspirantes.")
+
+def _review_keyboard(review):
+    keyboard = [[InlineKeyboardButton(f"{'☑' if key in review['selected'] else '☐'} {character_name}", callback_data=f"review_toggle_{key[0]}_{key[1]}")]
+                for key, character_name in review['players'].items()]
+    keyboard.append([InlineKeyboardButton("✅ Aprobar página como Aspirantes", callback_data="review_page")])
+    keyboard.append([InlineKeyboardButton("✔️ Aprobar seleccionados", callback_data="review_selected_aspirant"),
+                     InlineKeyboardButton("👑 Seleccionados como Campeones", callback_data="review_selected_champion")])
+    keyboard.append([InlineKeyboardButton("❌ Rechazar seleccionados", callback_data="review_selected_reject"),
+                     InlineKeyboardButton("▶️ Página siguiente", callback_data="review_next")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def send_review_page(context: ContextTypes.DEFAULT_TYPE, page, after=None):
+    """Envía las evidencias de una página agrupadas en un solo grupo de fotos, seguidas de su panel de acciones.
+
+    `after` es la última clave (canal, usuario) de la página anterior: las solicitudes ya
+    decididas no desplazan la página siguiente.
+    """
+    rows = await database.get_pending_players(REVIEW_PAGE_SIZE, page * REVIEW_PAGE_SIZE, after)
+    if not rows:
+        admin_outbox.send("No hay solicitudes pendientes en esta página.")
+        return
+    media = [InputMediaPhoto(evidence_file_id, caption=f"{character_name} — @{user_name} ({user_id})\nDominio: {specialty}\nCanal: {channel_id}")
+             for channel_id, user_id, user_name, character_name, specialty, evidence_file_id in rows if evidence_file_id]
+    if len(media) == 1:
+        # Un grupo de fotos necesita al menos dos elementos.
+        admin_outbox.call("send_photo", photo=media[0].media, caption=media[0].caption)
+    elif media:
+        admin_outbox.call("send_media_group", cost=len(media), media=media)
+    # Las solicitudes se identifican por (canal, usuario).
+    review = {'page': page, 'players': {(row[0], row[1]): row[3] for row in rows}, 'selected': set(),
+              'last_key': (rows[-1][0], rows[-1][1])}
+    # No se espera al panel: tras un grupo de fotos puede tardar decenas de segundos en salir
+    # y, mientras, el bot no atendería otras actualizaciones. Se registra cuando sale.
+    panel = admin_outbox.send(_review_text(review), reply_markup=_review_keyboard(review), parse_mode=ParseMode.MARKDOWN)
+    panel.add_done_callback(functools.partial(_register_review, context.chat_data, review))
+
+def _register_review(chat_data, review, future):
+    if not future.cancelled() and future.exception() is None:
+        chat_data.setdefault('reviews', {})[future.result().message_id] = review
+
+@metrics.handler
+async def revision_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: Muestra una página de solicitudes pendientes (`/revision <página>`)."""
+    if update.message.from_user.id != ADMIN_CHAT_ID: return
+    global pending_notice
+    pending_notice = None  # El próximo aviso se publicará debajo de esta revisión.
+    page = int(context.args[0]) - 1 if context.args and context.args[0].isdigit() and int(context.args[0]) > 0 else 0
+    await send_review_page(context, page)
+
+@metrics.handler
+async def handle_review_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Gestiona los botones del panel de revisión: marcar, aprobar o rechazar en bloque, o pasar de página."""
+    query = update.callback_query
+    reviews = context.chat_data.setdefault('reviews', {})
+    review = reviews.get(query.message.message_id)
+    if review is None:
+        await query.answer("Esta página de revisión ya no está activa.")
+        return
+    action = query.data[len("review_"):]
+
+    if action.startswith("toggle_"):
+        channel_id, user_id = action[len("toggle_"):].rsplit('_', 1)
+        review['selected'] ^= {(int(channel_id), int(user_id))}
+        await query.answer()
+        # Las pulsaciones rápidas se fusionan en una sola edición.
+        admin_outbox.edit(query.message, _review_text(review), reply_markup=_review_keyboard(review), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    if action == "next":
+        await query.answer()
+        del reviews[query.message.message_id]
+        admin_outbox.edit(query.message, f"📜 Página {review['page'] + 1} cerrada.", reply_markup=None)
+        await send_review_page(context, review['page'] + 1, review['last_key'])
+        return
+
+    if action == "page":
+        keys, is_champion = list(review['players']), False
+    else:
+        keys, is_champion = [key for key in review['players'] if key in review['selected']], action == "selected_champion"
+    if not keys:
+        await query.answer("No hay ningún guerrero seleccionado.")
+        return
+
+    if action == "selected_reject":
+        await database.reject_players(keys)
+        await query.answer(f"{len(keys)} guerreros rechazados.")
+        for channel_id, user_id in keys:
+            registrations.forget(channel_id, user_id)
+            dm_outbox.send(REJECTED_TEXT, chat_id=user_id)
+    else:
+        approved = await database.approve_players(keys, is_champion)
+        await query.answer(f"{len(approved)} guerreros aprobados.")
+        text = CHAMPION_APPROVED_TEXT if is_champion else ASPIRANT_APPROVED_TEXT
+        for _, user_id in approved:
+            dm_outbox.send(text, chat_id=user_id)
+    for key in keys:
+        review['players'].pop(key, None)
+        review['selected'].discard(key)
+    if review['players']:
+        admin_outbox.edit(query.message, _review_text(review), reply_markup=_review_keyboard(review), parse_mode=ParseMode.MARKDOWN)
+    else:
+        del reviews[query.message.message_id]
+        admin_outbox.edit(query.message, f"✅ Página {review['page'] + 1} revisada. Usa /revision para continuar.", reply_markup=None)
+
+async def pause(seconds):
+    """Pausa del torneo, escalada por TIME_SCALE."""
+    await asyncio.sleep(seconds * TIME_SCALE)
+
+async def run_fight(channel_outbox, player1, player2, narrate, arena_slots, on_result):
+    """Disputa un combate en una arena libre: cuenta atrás, narración y pausa final."""
+    async with arena_slots:
+        countdown_msg_text = f"Próximo combate: **{player1.character_name}** vs **{player2.character_name}**"
+        countdown_message = await channel_outbox.send(f"{countdown_msg_text}\nComienza en 60 segundos...", parse_mode=ParseMode.MARKDOWN)
+        for i in range(45, 0, -15):
+            await pause(15)
+            channel_outbox.edit(countdown_message, f"{countdown_msg_text}\nComienza en {i} segundos...", parse_mode=ParseMode.MARKDOWN)
+        await pause(15)
+        channel_outbox.edit(countdown_message, f"¡El combate entre **{player1.character_name}** y **{player2.character_name}** comienza AHORA!", parse_mode=ParseMode.MARKDOWN)
+        # Si la narración anticipada llegó a tiempo, esta espera es casi nula.
+        with metrics.timer("tournament_phase_seconds", phase="narration_wait"):
+            combat_text, winner, loser = await narrate()
+        channel_outbox.send(combat_text, parse_mode=ParseMode.MARKDOWN)
+        await pause(5)
+        on_result(winner, loser, combat_text)
+        await pause(60)
+
+async def run_tournament(tournament, resumed_round=None):
+    """Disputa las rondas hasta que quede un único guerrero, guardando puntos de control por el camino."""
+    game, channel_outbox = tournament.game, tournament.outbox
+    # Si algo falla a mitad, el canal queda libre y el torneo sin terminar en la base de datos,
+    # de modo que /reanudar lo retoma desde su último punto de control.
+    try:
+        while len(game.active_players) > 1:
+            round_started = asyncio.get_running_loop().time()
+            if resumed_round:
+                # Ronda interrumpida: los combates ya terminados no se repiten ni se vuelven a narrar.
+                status_panel, pairings, survivors, decided = resumed_round
+                resumed_round = None
+                await status_panel.publish(channel_outbox, parse_mode=ParseMode.MARKDOWN)
+            else:
+                with metrics.timer("tournament_phase_seconds", phase="round_setup"):
+                    status_panel = game.start_new_round()
+                    await status_panel.publish(channel_outbox, parse_mode=ParseMode.MARKDOWN)
+                    roster = [p.user_id for p in game.active_players]
+                    pairings, survivors = game.play_next_round_pairings()
+                    await database.save_round(game.tournament_id, game.round_number, roster,
+                                              [[p1.user_id, p2.user_id] for p1, p2 in pairings],
+                                              [p.user_id for p in survivors], game.rng.getstate())
+                decided = {}
+            remaining = [(index, player1, player2) for index, (player1, player2) in enumerate(pairings) if index not in decided]
+            # Cada arena necesita su narración lista al terminar su cuenta atrás.
+            prefetcher = CombatPrefetcher(game, [(player1, player2) for _, player1, player2 in remaining], NARRATION_PREFETCH_DEPTH + ARENAS - 1)
+            prefetcher.start()
+            await pause(5)
+            active_survivors = []
+            if survivors:
+                # Un solo anuncio (o los mínimos necesarios) en lugar de un mensaje por superviviente.
+                survivor_lines = ["**Avanzan directamente:**"]
+                for survivor in survivors:
+                    title = "👑 Campeón" if survivor.is_champion else "🍀 Afortunado"
+                    survivor_lines.append(f"{title} **{survivor.character_name}** ({survivor.mention()})")
+                    active_survivors.append(survivor)
+                for text in split_lines(survivor_lines):
+                    channel_outbox.send(text, parse_mode=ParseMode.MARKDOWN)
+            # Los ganadores se guardan por posición para que la ronda siguiente no dependa
+            # del orden en que terminan las arenas (y el torneo siga siendo reproducible).
+            winners = [decided.get(index) for index in range(len(pairings))]
+
+            def on_result(index, winner, loser, combat_text):
+                winners[index] = winner
+                status_panel.eliminate(loser)
+                status_panel.flush(channel_outbox)
+                checkpoints.record_fight(game.tournament_id, game.round_number, index, winner, loser, combat_text)
+
+            arena_slots = asyncio.Semaphore(ARENAS)
+            fights = [asyncio.create_task(run_fight(channel_outbox, player1, player2, functools.partial(prefetcher.result, position),
+                                                    arena_slots, functools.partial(on_result, index)))
+                      for position, (index, player1, player2) in enumerate(remaining)]
+            try:
+                await asyncio.gather(*fights)
+            finally:
+                for fight in fights:
+                    fight.cancel()
+                prefetcher.cancel()
+                await checkpoints.flush()
+            status_panel.unpin(channel_outbox)
+            game.advance_round(active_survivors, winners)
+            metrics.observe("tournament_phase_seconds", asyncio.get_running_loop().time() - round_started, phase="round")
+        if len(game.active_players) == 1:
+            winner = game.active_players[0]
+            win_message = (f"✨ **¡UNA NUEVA LEYENDA HA NACIDO!** ✨\n\nEl combate ha concluido. El único vencedor es...\n\n"
+                           f"**¡¡{winner.character_name.upper()} ({winner.mention()})!!**\n\n"
+                           f"¡Su nombre será grabado en las estrellas!")
+            channel_outbox.send(win_message, parse_mode=ParseMode.MARKDOWN)
+            await database.finish_tournament(game.tournament_id, winner.user_id)
+    finally:
+        game.end_game()
+    await channel_outbox.drain()
 
 async def accion_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    #... (código idéntico a la versión anterior)
+    """Admin: Inicia el torneo de un canal con sus guerreros aprobados (`/accion [canal] [semilla]`)."""
     if update.message.from_user.id != ADMIN_CHAT_ID: return
+    channel_id, args = _split_channel_arg(context.args)
+    tournament = scheduler.get(channel_id)
+    game = tournament.game
+    if game.is_running:
+        await update.message.reply_text("Ya hay un torneo en curso en ese canal.")
+        return
     game.is_invocation_open = False
-    player_rows = database.get_approved_players()
+    player_rows = await database.get_approved_players(channel_id)
     if len(player_rows) < 2:
         await update.message.reply_text("No hay suficientes guerreros aprobados para comenzar (se necesitan al menos 2).")
         return
-    game.load_players(player_rows)
-    await update.message.reply_text(f"Iniciando la acción en el canal con {len(game.active_players)} guerreros...")
-    await context.bot.send_message(chat_id=CHANNEL_ID, text=f"🔥 **¡EL COMBATE ETERNO COMIENZA!** 🔥", parse_mode=ParseMode.MARKDOWN)
-    while len(game.active_players) > 1:
-        status_text = game.start_new_round()
-        status_message = await context.bot.send_message(chat_id=CHANNEL_ID, text=status_text, parse_mode=ParseMode.MARKDOWN)
-        await asyncio.sleep(5)
-        pairings, survivors = game.play_next_round_pairings()
-        active_survivors = []
-        if survivors:
-            for survivor in survivors:
-                title = "👑 Campeón" if survivor.is_champion else "🍀 Afortunado"
-                await context.bot.send_message(chat_id=CHANNEL_ID, text=f"{title} **{survivor.character_name}** ({survivor.mention()}) avanza directamente.", parse_mode=ParseMode.MARKDOWN)
-                active_survivors.append(survivor)
-        game.active_players = [p for p in game.active_players if p not in active_survivors]
-        for player1, player2 in pairings:
-            countdown_msg_text = f"Próximo combate: **{player1.character_name}** vs **{player2.character_name}**"
-            countdown_message = await context.bot.send_message(chat_id=CHANNEL_ID, text=f"{countdown_msg_text}\nComienza en 60 segundos...", parse_mode=ParseMode.MARKDOWN)
-            for i in range(45, 0, -15):
-                await asyncio.sleep(15)
-                await countdown_message.edit_text(f"{countdown_msg_text}\nComienza en {i} segundos...", parse_mode=ParseMode.MARKDOWN)
-            await asyncio.sleep(15)
-            await countdown_message.edit_text(f"¡El combate entre **{player1.character_name}** y **{player2.character_name}** comienza AHORA!", parse_mode=ParseMode.MARKDOWN)
-            combat_text, winner, loser = game.simulate_combat(player1, player2)
-            await context.bot.send_message(chat_id=CHANNEL_ID, text=combat_text, parse_mode=ParseMode.MARKDOWN)
-            await asyncio.sleep(5)
-            active_survivors.append(winner)
-            status_text = game.update_status_text(status_text, loser)
-            await status_message.edit_text(status_text, parse_mode=ParseMode.MARKDOWN)
-            await asyncio.sleep(60)
-        game.active_players = active_survivors
-    if len(game.active_players) == 1:
-        winner = game.active_players[0]
-        win_message = (f"✨ **¡UNA NUEVA LEYENDA HA NACIDO!** ✨\n\nEl combate ha concluido. El único vencedor es...\n\n"
-                       f"**¡¡{winner.character_name.upper()} ({winner.mention()})!!**\n\n"
-                       f"¡Su nombre será grabado en las estrellas!")
-        await context.bot.send_message(chat_id=CHANNEL_ID, text=win_message, parse_mode=ParseMode.MARKDOWN)
-    game.end_game()
+    # `/accion <semilla>` repite un torneo anterior con los mismos resultados.
+    seed = int(args[0]) if args and args[0].isdigit() else None
+    with metrics.timer("tournament_phase_seconds", phase="setup"):
+        game.load_players(player_rows, seed=seed)
+        game.tournament_id = await database.create_tournament(channel_id, game.seed, player_rows)
+        game.ratings = await database.get_seed_ratings(game.tournament_id)
+    await update.message.reply_text(f"Iniciando la acción en el canal {channel_id} con {len(game.active_players)} guerreros (semilla {game.seed})...")
+    tournament.outbox.send(f"🔥 **¡EL COMBATE ETERNO COMIENZA!** 🔥", parse_mode=ParseMode.MARKDOWN)
+    scheduler.launch(tournament, run_tournament(tournament))
+
+async def reanudar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: Reanuda el último torneo interrumpido de un canal desde su último combate terminado (`/reanudar [canal]`)."""
+    if update.message.from_user.id != ADMIN_CHAT_ID: return
+    channel_id, _ = _split_channel_arg(context.args)
+    tournament = scheduler.get(channel_id)
+    game = tournament.game
+    if game.is_running:
+        await update.message.reply_text("Ya hay un torneo en curso en ese canal.")
+        return
+    checkpoint = await database.get_unfinished_tournament(channel_id)
+    if checkpoint is None:
+        await update.message.reply_text("No hay ningún torneo interrumpido que reanudar en ese canal.")
+        return
+    resumed_round = game.restore(*checkpoint)
+    # Las puntuaciones congeladas al empezar: los emparejamientos sembrados salen iguales.
+    game.ratings = await database.get_seed_ratings(game.tournament_id)
+    game.is_invocation_open = False
+    await update.message.reply_text(f"Reanudando el torneo {game.tournament_id} (ronda {game.round_number}, {len(game.active_players)} guerreros)...")
+    tournament.outbox.send(f"🔥 **¡EL COMBATE ETERNO SE REANUDA!** 🔥", parse_mode=ParseMode.MARKDOWN)
+    scheduler.launch(tournament, run_tournament(tournament, resumed_round))
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: Muestra las latencias y contadores recogidos desde el arranque."""
+    if update.message.from_user.id != ADMIN_CHAT_ID: return
+    for text in split_lines(metrics.summary_lines()):
+        await update.message.reply_text(text)
+
+def _format_rating(position, row):
+    user_id, user_name, character_name, rating, wins, losses, tournaments, titles = row
+    # Como en Player.mention(): sin nombre de usuario de Telegram basta con el del personaje.
+    handle = f" (@{user_name})" if user_name else ""
+    return (f"{position}. {character_name}{handle} — {rating:.0f} pts, "
+            f"{wins}V/{losses}D, {tournaments} torneo(s), {titles} título(s)")
+
+@metrics.handler
+async def clasificacion_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra la clasificación Elo de todos los torneos (`/clasificacion [puestos]`)."""
+    limit = LEADERBOARD_SIZE
+    if context.args and context.args[0].isdigit():
+        limit = max(1, min(int(context.args[0]), LEADERBOARD_MAX_SIZE))
+    rows = await database.get_leaderboard(limit)
+    if not rows:
+        await update.message.reply_text("Todavía no se ha disputado ningún combate.")
+        return
+    lines = ["🏆 Clasificación del Coliseo 🏆"] + [_format_rating(position, row) for position, row in enumerate(rows, 1)]
+    for text in split_lines(lines):
+        await update.message.reply_text(text)
+
+@metrics.handler
+async def perfil_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra la ficha de un guerrero (`/perfil [@usuario|id]`; sin argumento, la propia)."""
+    if not context.args:
+        profile = await database.get_profile(user_id=update.message.from_user.id)
+    elif context.args[0].isdigit():
+        profile = await database.get_profile(user_id=int(context.args[0]))
+    else:
+        profile = await database.get_profile(user_name=context.args[0].lstrip("@"))
+    if profile is None:
+        await update.message.reply_text("Ese guerrero aún no ha combatido en el Coliseo.")
+        return
+    row, position = profile
+    await update.message.reply_text(_format_rating(position, row))
+
+async def warm_up():
+    """Carga en segundo plano las dependencias pesadas (Gemini) sin retrasar la recepción de actualizaciones."""
+    await asyncio.gather(*(tournament.game.warm_up() for tournament in scheduler.tournaments()))
+    bot_ready.set()
+    # Torneos creados mientras tanto (los posteriores se calientan al crearse).
+    await asyncio.gather(*(tournament.game.warm_up() for tournament in scheduler.tournaments()))
+    print("Calentamiento terminado: el bot está listo.")
+
+async def on_startup(app: Application):
+    """Crea las tablas, arranca las colas de mensajes salientes y los guardados en segundo plano, y lanza el calentamiento."""
+    await database.initialize_db(CHANNEL_ID)
+    scheduler.get(CHANNEL_ID)
+    scheduler.start(app.bot)
+    admin_outbox.start(app.bot)
+    dm_outbox.start(app.bot)
+    checkpoints.start()
+    await registrations.start()
+    await narration_cache.start()
+    if metrics_writer:
+        metrics_writer.start()
+    app.create_task(warm_up())
+
+async def on_shutdown(app: Application):
+    """Detiene los torneos y las colas de salida, y cierra la conexión persistente a la base de datos."""
+    await scheduler.stop()
+    await admin_outbox.stop()
+    await dm_outbox.stop()
+    await checkpoints.stop()
+    await registrations.stop()
+    await narration_cache.stop()
+    if metrics_writer:
+        await metrics_writer.stop()
+    await database.close_db()
+
+async def serve_metrics():
+    """GET /metrics: métricas en formato Prometheus."""
+    return 200, metrics.render_prometheus()
+
+async def run_webhook(app: Application):
+    """Recibe las actualizaciones por webhook con nuestro propio servidor HTTP (con /ready y /health)."""
+    # El bot registra el secreto en set_webhook: no hace falta conocerlo de antemano.
+    secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+    server = WebhookServer(app, WEBHOOK_PATH, secret_token, bot_ready, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT)
+    if WEBHOOK_SERVE_METRICS:
+        server.routes["/metrics"] = serve_metrics
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with app:
+        # post_init/post_shutdown solo los llama run_polling: aquí van a mano.
+        await on_startup(app)
+        await app.start()
+        await server.start()
+        await app.bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}", secret_token=secret_token,
+                                  allowed_updates=Update.ALL_TYPES)
+        print(f"Webhook escuchando en {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+            await on_shutdown(app)
 
 def main():
     """Función principal que inicia el bot."""
     print("Iniciando el bot del Coliseo (Modo Telegram)...")
-    app = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+    app = Application.builder().token(config.TELEGRAM_BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
     
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("invocacion", invocacion_start)],
+        entry_points=[CommandHandler("invocacion", invocacion_start),
+                      MessageHandler(filters.StatusUpdate.WEB_APP_DATA, invocacion_webapp)],
         states={
             GET_EVIDENCE: [MessageHandler(filters.PHOTO, get_evidence_image)],
         },
@@ -225,11 +694,21 @@ def main():
     app.add_handler(conv_handler)
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("abrir_convocatoria", abrir_convocatoria))
-    app.add_handler(CommandHandler("accion", accion_command))
+    # El torneo dura horas: no debe bloquear el procesamiento del resto de actualizaciones.
+    app.add_handler(CommandHandler("accion", accion_command, block=False))
+    app.add_handler(CommandHandler("reanudar", reanudar_command, block=False))
+    app.add_handler(CommandHandler("revision", revision_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("clasificacion", clasificacion_command))
+    app.add_handler(CommandHandler("perfil", perfil_command))
+    app.add_handler(CallbackQueryHandler(handle_review_action, pattern="^review_"))
     app.add_handler(CallbackQueryHandler(handle_admin_decision))
     
     print("Bot en línea. A la espera de la llamada de los guerreros.")
-    app.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
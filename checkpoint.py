@@ -0,0 +1,46 @@
+# checkpoint.py
+import asyncio
+
+import database
+
+class CheckpointWriter:
+    """Acumula los combates terminados y los guarda en SQLite por lotes, sin frenar el torneo."""
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._pending = []
+        self._worker = None
+
+    def start(self):
+        """Arranca el volcado periódico en segundo plano."""
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el volcado periódico, guardando lo que quede pendiente."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
+
+    def record_fight(self, tournament_id, round_number, fight_index, winner, loser, narration):
+        """Anota un combate terminado para el próximo lote."""
+        self._pending.append((tournament_id, round_number, fight_index, winner.user_id, loser.user_id, narration))
+
+    async def flush(self):
+        """Escribe ahora todos los combates pendientes en una sola transacción."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await database.save_fights(batch)
+        except Exception as e:
+            print(f"Error al guardar el punto de control: {e}")
+            self._pending = batch + self._pending
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
@@ -1,93 +1,515 @@
 # database.py
+import asyncio
+import json
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from rating import DEFAULT_RATING, elo_update
 
 DB_NAME = "coliseum.db"
 
-def initialize_db():
-    """Crea la tabla de jugadores si no existe."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS players (
-            user_id INTEGER PRIMARY KEY,
-            user_name TEXT,
-            character_name TEXT,
-            specialty TEXT,
-            absurd_skill TEXT,
-            is_champion BOOLEAN,
-            is_approved BOOLEAN DEFAULT 0
-        )
-    ''')
+# Una única conexión de larga duración, usada siempre desde el mismo hilo.
+# Todo el trabajo de SQLite se ejecuta fuera del bucle de eventos del bot.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coliseum-db")
+_conn = None
+
+# --- SENTENCIAS (constantes para aprovechar la caché de sentencias preparadas de sqlite3) ---
+
+# Cada canal tiene su propia convocatoria: un mismo usuario puede inscribirse en varias.
+SQL_CREATE_PLAYERS = '''
+    CREATE TABLE IF NOT EXISTS players (
+        channel_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        user_name TEXT,
+        character_name TEXT,
+        specialty TEXT,
+        absurd_skill TEXT,
+        is_champion BOOLEAN,
+        is_approved BOOLEAN DEFAULT 0,
+        evidence_file_id TEXT,
+        PRIMARY KEY (channel_id, user_id)
+    )
+'''
+# Bases de datos anteriores no tienen la columna de la evidencia ni la del canal.
+SQL_ADD_EVIDENCE_COLUMN = 'ALTER TABLE players ADD COLUMN evidence_file_id TEXT'
+SQL_MIGRATE_PLAYERS_TO_CHANNELS = '''
+    ALTER TABLE players RENAME TO players_old;
+    {create};
+    INSERT INTO players (channel_id, user_id, user_name, character_name, specialty, absurd_skill, is_champion, is_approved, evidence_file_id)
+    SELECT {channel_id}, user_id, user_name, character_name, specialty, absurd_skill, is_champion, is_approved, evidence_file_id FROM players_old;
+    DROP TABLE players_old;
+'''
+SQL_CREATE_PENDING_INDEX = 'CREATE INDEX IF NOT EXISTS idx_players_is_approved ON players (is_approved, channel_id, user_id)'
+# Puntos de control del torneo: permiten reanudarlo tras un reinicio.
+SQL_CREATE_CHECKPOINT_TABLES = '''
+    CREATE TABLE IF NOT EXISTS tournaments (
+        tournament_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seed INTEGER,
+        is_finished BOOLEAN DEFAULT 0,
+        winner_id INTEGER,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        channel_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS tournament_players (
+        tournament_id INTEGER,
+        user_id INTEGER,
+        user_name TEXT,
+        character_name TEXT,
+        specialty TEXT,
+        absurd_skill TEXT,
+        is_champion BOOLEAN,
+        seed_rating REAL,
+        PRIMARY KEY (tournament_id, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS rounds (
+        tournament_id INTEGER,
+        round_number INTEGER,
+        roster TEXT,
+        pairings TEXT,
+        survivors TEXT,
+        rng_state TEXT,
+        PRIMARY KEY (tournament_id, round_number)
+    );
+    CREATE TABLE IF NOT EXISTS fights (
+        tournament_id INTEGER,
+        round_number INTEGER,
+        fight_index INTEGER,
+        winner_id INTEGER,
+        loser_id INTEGER,
+        narration TEXT,
+        PRIMARY KEY (tournament_id, round_number, fight_index)
+    );
+'''
+# Clasificación materializada: se actualiza combate a combate y se consulta por índice,
+# sin recorrer el historial de combates.
+SQL_CREATE_RATINGS = f'''
+    CREATE TABLE IF NOT EXISTS ratings (
+        user_id INTEGER PRIMARY KEY,
+        user_name TEXT,
+        character_name TEXT,
+        rating REAL NOT NULL DEFAULT {DEFAULT_RATING},
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        tournaments INTEGER NOT NULL DEFAULT 0,
+        titles INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_ratings_rating ON ratings (rating DESC, user_id);
+    CREATE INDEX IF NOT EXISTS idx_ratings_user_name ON ratings (user_name COLLATE NOCASE);
+'''
+SQL_CREATE_NARRATION_CACHE = '''
+    CREATE TABLE IF NOT EXISTS narration_cache (
+        cache_key TEXT PRIMARY KEY,
+        narration TEXT,
+        last_used REAL
+    )
+'''
+SQL_ADD_TOURNAMENT_CHANNEL_COLUMN = 'ALTER TABLE tournaments ADD COLUMN channel_id INTEGER'
+SQL_ADD_SEED_RATING_COLUMN = 'ALTER TABLE tournament_players ADD COLUMN seed_rating REAL'
+SQL_SET_LEGACY_TOURNAMENT_CHANNEL = 'UPDATE tournaments SET channel_id = ? WHERE channel_id IS NULL'
+SQL_ADD_SUBMISSION = '''
+    INSERT INTO players (channel_id, user_id, user_name, character_name, specialty, absurd_skill, is_approved, evidence_file_id)
+    VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+    ON CONFLICT(channel_id, user_id) DO UPDATE SET
+    character_name=excluded.character_name,
+    specialty=excluded.specialty,
+    absurd_skill=excluded.absurd_skill,
+    is_approved=0,
+    evidence_file_id=excluded.evidence_file_id
+'''
+SQL_APPROVE = 'UPDATE players SET is_approved = 1, is_champion = ? WHERE channel_id = ? AND user_id = ?'
+SQL_APPROVE_PENDING = 'UPDATE players SET is_approved = 1, is_champion = ? WHERE channel_id = ? AND user_id = ? AND is_approved = 0'
+SQL_PENDING_PLAYERS = '''
+    SELECT channel_id, user_id, user_name, character_name, specialty, evidence_file_id
+    FROM players WHERE is_approved = 0 ORDER BY channel_id, user_id LIMIT ? OFFSET ?
+'''
+# Paginación por clave: la cola mengua mientras el admin decide, así que un OFFSET saltaría solicitudes.
+SQL_PENDING_PLAYERS_AFTER = '''
+    SELECT channel_id, user_id, user_name, character_name, specialty, evidence_file_id
+    FROM players WHERE is_approved = 0 AND (channel_id, user_id) > (?, ?) ORDER BY channel_id, user_id LIMIT ?
+'''
+SQL_COUNT_PENDING = 'SELECT COUNT(*) FROM players WHERE is_approved = 0'
+SQL_REJECT = 'DELETE FROM players WHERE channel_id = ? AND user_id = ?'
+SQL_PLAYER_INFO = 'SELECT character_name, specialty FROM players WHERE channel_id = ? AND user_id = ?'
+SQL_APPROVED_PLAYERS = '''
+    SELECT user_id, user_name, character_name, specialty, absurd_skill, is_champion, is_approved, evidence_file_id
+    FROM players WHERE channel_id = ? AND is_approved = 1
+'''
+SQL_CLEAR_PLAYERS = 'DELETE FROM players WHERE channel_id = ?'
+SQL_PLAYER_EXISTS = 'SELECT 1 FROM players WHERE channel_id = ? AND user_id = ?'
+SQL_PLAYER_KEYS = 'SELECT channel_id, user_id FROM players'
+SQL_CREATE_TOURNAMENT = 'INSERT INTO tournaments (seed, channel_id) VALUES (?, ?)'
+# La puntuación de arranque de cada jugador se congela en tournament_players (para sembrar y reanudar).
+SQL_ADD_TOURNAMENT_PLAYER = '''
+    INSERT INTO tournament_players (tournament_id, user_id, user_name, character_name, specialty, absurd_skill, is_champion, seed_rating)
+    SELECT ?, ?, ?, ?, ?, ?, ?, rating FROM ratings WHERE user_id = ?
+'''
+SQL_REGISTER_RATING = '''
+    INSERT INTO ratings (user_id, user_name, character_name, tournaments) VALUES (?, ?, ?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET
+    user_name=excluded.user_name,
+    character_name=excluded.character_name,
+    tournaments=tournaments + 1
+'''
+SQL_SEED_RATINGS = 'SELECT user_id, seed_rating FROM tournament_players WHERE tournament_id = ? AND seed_rating IS NOT NULL'
+SQL_SAVE_ROUND = 'INSERT OR REPLACE INTO rounds VALUES (?, ?, ?, ?, ?, ?)'
+# Un combate ya guardado no se vuelve a contar (reintentos de lote, reanudaciones).
+SQL_SAVE_FIGHT = 'INSERT OR IGNORE INTO fights VALUES (?, ?, ?, ?, ?, ?)'
+SQL_FIGHT_RATINGS = 'SELECT user_id, rating FROM ratings WHERE user_id IN (?, ?)'
+SQL_RECORD_WIN = '''
+    INSERT INTO ratings (user_id, rating, wins) VALUES (?, ?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET rating=excluded.rating, wins=wins + 1
+'''
+SQL_RECORD_LOSS = '''
+    INSERT INTO ratings (user_id, rating, losses) VALUES (?, ?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET rating=excluded.rating, losses=losses + 1
+'''
+SQL_FINISH_TOURNAMENT = 'UPDATE tournaments SET is_finished = 1, winner_id = ? WHERE tournament_id = ?'
+SQL_RECORD_TITLE = 'UPDATE ratings SET titles = titles + 1 WHERE user_id = ?'
+SQL_LEADERBOARD = '''
+    SELECT user_id, user_name, character_name, rating, wins, losses, tournaments, titles
+    FROM ratings ORDER BY rating DESC, user_id LIMIT ? OFFSET ?
+'''
+SQL_PROFILE = '''
+    SELECT user_id, user_name, character_name, rating, wins, losses, tournaments, titles
+    FROM ratings WHERE user_id = ?
+'''
+SQL_PROFILE_BY_NAME = '''
+    SELECT user_id, user_name, character_name, rating, wins, losses, tournaments, titles
+    FROM ratings WHERE user_name = ? COLLATE NOCASE
+'''
+SQL_RANK = 'SELECT COUNT(*) + 1 FROM ratings WHERE rating > ?'
+# Reconstrucción de la clasificación a partir del historial (bases de datos anteriores a ella).
+SQL_HISTORY_TOURNAMENTS = 'SELECT tournament_id FROM tournaments ORDER BY tournament_id'
+SQL_HISTORY_PLAYERS = 'SELECT user_id, user_name, character_name FROM tournament_players WHERE tournament_id = ?'
+SQL_HISTORY_FIGHTS = 'SELECT winner_id, loser_id FROM fights WHERE tournament_id = ? ORDER BY round_number, fight_index'
+SQL_HISTORY_TITLES = '''
+    UPDATE ratings SET titles = (SELECT COUNT(*) FROM tournaments WHERE tournaments.winner_id = ratings.user_id)
+'''
+SQL_UNFINISHED_TOURNAMENT = '''
+    SELECT tournament_id, seed FROM tournaments
+    WHERE channel_id = ? AND is_finished = 0 ORDER BY tournament_id DESC LIMIT 1
+'''
+SQL_TOURNAMENT_PLAYERS = '''
+    SELECT user_id, user_name, character_name, specialty, absurd_skill, is_champion
+    FROM tournament_players WHERE tournament_id = ?
+'''
+SQL_LAST_ROUND = '''
+    SELECT round_number, roster, pairings, survivors, rng_state
+    FROM rounds WHERE tournament_id = ? ORDER BY round_number DESC LIMIT 1
+'''
+SQL_LOAD_NARRATIONS = '''
+    SELECT cache_key, narration FROM (
+        SELECT cache_key, narration, last_used FROM narration_cache ORDER BY last_used DESC LIMIT ?
+    ) ORDER BY last_used ASC
+'''
+SQL_SAVE_NARRATION = 'INSERT OR REPLACE INTO narration_cache VALUES (?, ?, ?)'
+SQL_DELETE_NARRATION = 'DELETE FROM narration_cache WHERE cache_key = ?'
+SQL_ROUND_FIGHTS = 'SELECT fight_index, winner_id, loser_id, narration FROM fights WHERE tournament_id = ? AND round_number = ?'
+
+def _get_connection():
+    """Abre (una sola vez) la conexión persistente en modo WAL."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+        _conn.execute('PRAGMA journal_mode=WAL')
+        _conn.execute('PRAGMA synchronous=NORMAL')
+    return _conn
+
+async def _run(func, *args):
+    """Ejecuta una función de base de datos en el hilo dedicado sin bloquear el bucle."""
+    loop = asyncio.get_running_loop()
+    with metrics.timer("db_query_seconds", query=func.__name__.lstrip("_")):
+        return await loop.run_in_executor(_executor, func, *args)
+
+# --- IMPLEMENTACIONES SÍNCRONAS (se ejecutan siempre en el hilo de la base de datos) ---
+
+def _initialize_db(default_channel_id):
+    conn = _get_connection()
+    conn.execute(SQL_CREATE_PLAYERS)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(players)')]
+    if 'evidence_file_id' not in columns:
+        conn.execute(SQL_ADD_EVIDENCE_COLUMN)
+    if 'channel_id' not in columns:
+        # La clave primaria cambia: hay que reconstruir la tabla. Lo anterior pasa al canal por defecto.
+        conn.executescript(SQL_MIGRATE_PLAYERS_TO_CHANNELS.format(create=SQL_CREATE_PLAYERS, channel_id=int(default_channel_id)))
+    conn.execute(SQL_CREATE_PENDING_INDEX)
+    conn.executescript(SQL_CREATE_CHECKPOINT_TABLES)
+    if 'channel_id' not in [row[1] for row in conn.execute('PRAGMA table_info(tournaments)')]:
+        conn.execute(SQL_ADD_TOURNAMENT_CHANNEL_COLUMN)
+    conn.execute(SQL_SET_LEGACY_TOURNAMENT_CHANNEL, (default_channel_id,))
+    if 'seed_rating' not in [row[1] for row in conn.execute('PRAGMA table_info(tournament_players)')]:
+        conn.execute(SQL_ADD_SEED_RATING_COLUMN)
+    conn.execute(SQL_CREATE_NARRATION_CACHE)
     conn.commit()
-    conn.close()
+    has_ratings = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ratings'").fetchone()
+    conn.executescript(SQL_CREATE_RATINGS)
+    if not has_ratings:
+        with conn:
+            _rebuild_ratings(conn)
+
+def _apply_rating(conn, winner_id, loser_id):
+    ratings = dict(conn.execute(SQL_FIGHT_RATINGS, (winner_id, loser_id)).fetchall())
+    winner_rating, loser_rating = elo_update(ratings.get(winner_id, DEFAULT_RATING), ratings.get(loser_id, DEFAULT_RATING))
+    conn.execute(SQL_RECORD_WIN, (winner_id, winner_rating))
+    conn.execute(SQL_RECORD_LOSS, (loser_id, loser_rating))
+
+def _rebuild_ratings(conn):
+    """Recalcula la clasificación recorriendo el historial en orden (una sola vez, al crearla)."""
+    for (tournament_id,) in conn.execute(SQL_HISTORY_TOURNAMENTS).fetchall():
+        conn.executemany(SQL_REGISTER_RATING, conn.execute(SQL_HISTORY_PLAYERS, (tournament_id,)).fetchall())
+        for winner_id, loser_id in conn.execute(SQL_HISTORY_FIGHTS, (tournament_id,)).fetchall():
+            _apply_rating(conn, winner_id, loser_id)
+    conn.execute(SQL_HISTORY_TITLES)
 
-def add_player_submission(user_id, user_name, character_name, specialty, absurd_skill):
-    """Añade una nueva solicitud de jugador a la base de datos, pendiente de aprobación."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def _add_player_submission(channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id):
+    conn = _get_connection()
     try:
-        cursor.execute('''
-            INSERT INTO players (user_id, user_name, character_name, specialty, absurd_skill, is_approved)
-            VALUES (?, ?, ?, ?, ?, 0)
-            ON CONFLICT(user_id) DO UPDATE SET
-            character_name=excluded.character_name,
-            specialty=excluded.specialty,
-            absurd_skill=excluded.absurd_skill,
-            is_approved=0
-        ''', (user_id, user_name, character_name, specialty, absurd_skill))
+        conn.execute(SQL_ADD_SUBMISSION, (channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id))
         conn.commit()
     except sqlite3.Error as e:
+        conn.rollback()
         print(f"Error en la base de datos al añadir solicitud: {e}")
-    finally:
-        conn.close()
 
-def approve_player(user_id, is_champion):
-    """Marca a un jugador como aprobado y asigna su estatus."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE players SET is_approved = 1, is_champion = ? WHERE user_id = ?', (is_champion, user_id))
+def _add_player_submissions(rows):
+    conn = _get_connection()
+    try:
+        with conn:
+            conn.executemany(SQL_ADD_SUBMISSION, rows)
+    except sqlite3.Error as e:
+        print(f"Error en la base de datos al añadir {len(rows)} solicitudes: {e}")
+        raise
+
+def _approve_player(channel_id, user_id, is_champion):
+    conn = _get_connection()
+    conn.execute(SQL_APPROVE, (is_champion, channel_id, user_id))
     conn.commit()
-    conn.close()
 
-def reject_player(user_id):
-    """Elimina una solicitud de jugador de la base de datos."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM players WHERE user_id = ?', (user_id,))
+def _approve_players(keys, is_champion):
+    conn = _get_connection()
+    approved = []
+    with conn:
+        for channel_id, user_id in keys:
+            if conn.execute(SQL_APPROVE_PENDING, (is_champion, channel_id, user_id)).rowcount:
+                approved.append((channel_id, user_id))
+    return approved
+
+def _reject_players(keys):
+    conn = _get_connection()
+    with conn:
+        conn.executemany(SQL_REJECT, keys)
+
+def _get_pending_players(limit, offset, after):
+    if after is not None:
+        return _get_connection().execute(SQL_PENDING_PLAYERS_AFTER, (*after, limit)).fetchall()
+    return _get_connection().execute(SQL_PENDING_PLAYERS, (limit, offset)).fetchall()
+
+def _count_pending_players():
+    return _get_connection().execute(SQL_COUNT_PENDING).fetchone()[0]
+
+def _reject_player(channel_id, user_id):
+    conn = _get_connection()
+    conn.execute(SQL_REJECT, (channel_id, user_id))
     conn.commit()
-    conn.close()
 
-def get_player_info(user_id):
-    """Obtiene la información de un jugador específico."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT character_name, specialty FROM players WHERE user_id = ?', (user_id,))
-    player = cursor.fetchone()
-    conn.close()
-    return player
-
-def get_approved_players():
-    """Devuelve una lista de todos los jugadores aprobados."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM players WHERE is_approved = 1')
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-def clear_all_players():
-    """Limpia la tabla de jugadores para un nuevo torneo."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM players')
+def _get_player_info(channel_id, user_id):
+    return _get_connection().execute(SQL_PLAYER_INFO, (channel_id, user_id)).fetchone()
+
+def _get_approved_players(channel_id):
+    return _get_connection().execute(SQL_APPROVED_PLAYERS, (channel_id,)).fetchall()
+
+def _clear_players(channel_id):
+    conn = _get_connection()
+    conn.execute(SQL_CLEAR_PLAYERS, (channel_id,))
     conn.commit()
-    conn.close()
-
-def player_exists(user_id):
-    """Verifica si un jugador (aprobado o no) ya existe."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM players WHERE user_id = ?', (user_id,))
-    exists = cursor.fetchone() is not None
-    conn.close()
-    return exists
\ No newline at end of file
+
+def _player_exists(channel_id, user_id):
+    return _get_connection().execute(SQL_PLAYER_EXISTS, (channel_id, user_id)).fetchone() is not None
+
+def _get_player_keys():
+    return [tuple(row) for row in _get_connection().execute(SQL_PLAYER_KEYS)]
+
+def _create_tournament(channel_id, seed, player_rows):
+    conn = _get_connection()
+    with conn:
+        tournament_id = conn.execute(SQL_CREATE_TOURNAMENT, (seed, channel_id)).lastrowid
+        conn.executemany(SQL_REGISTER_RATING, [row[:3] for row in player_rows])
+        conn.executemany(SQL_ADD_TOURNAMENT_PLAYER, [(tournament_id, *row[:6], row[0]) for row in player_rows])
+    return tournament_id
+
+def _get_seed_ratings(tournament_id):
+    return dict(_get_connection().execute(SQL_SEED_RATINGS, (tournament_id,)).fetchall())
+
+def _save_round(tournament_id, round_number, roster, pairings, survivors, rng_state):
+    conn = _get_connection()
+    with conn:
+        conn.execute(SQL_SAVE_ROUND, (tournament_id, round_number, json.dumps(roster), json.dumps(pairings),
+                                      json.dumps(survivors), json.dumps(rng_state)))
+
+def _save_fights(fight_rows):
+    conn = _get_connection()
+    with conn:
+        for row in fight_rows:
+            # La puntuación se actualiza en la misma transacción, solo si el combate es nuevo.
+            if conn.execute(SQL_SAVE_FIGHT, row).rowcount:
+                _apply_rating(conn, row[3], row[4])
+
+def _finish_tournament(tournament_id, winner_id):
+    conn = _get_connection()
+    with conn:
+        if conn.execute(SQL_FINISH_TOURNAMENT, (winner_id, tournament_id)).rowcount:
+            conn.execute(SQL_RECORD_TITLE, (winner_id,))
+
+def _get_leaderboard(limit, offset):
+    return _get_connection().execute(SQL_LEADERBOARD, (limit, offset)).fetchall()
+
+def _get_profile(user_id, user_name):
+    conn = _get_connection()
+    if user_id is not None:
+        profile = conn.execute(SQL_PROFILE, (user_id,)).fetchone()
+    else:
+        profile = conn.execute(SQL_PROFILE_BY_NAME, (user_name,)).fetchone()
+    if profile is None:
+        return None
+    return profile, conn.execute(SQL_RANK, (profile[3],)).fetchone()[0]
+
+def _get_unfinished_tournament(channel_id):
+    conn = _get_connection()
+    tournament = conn.execute(SQL_UNFINISHED_TOURNAMENT, (channel_id,)).fetchone()
+    if tournament is None:
+        return None
+    tournament_id, seed = tournament
+    player_rows = conn.execute(SQL_TOURNAMENT_PLAYERS, (tournament_id,)).fetchall()
+    last_round = conn.execute(SQL_LAST_ROUND, (tournament_id,)).fetchone()
+    fights = []
+    if last_round is not None:
+        round_number, roster, pairings, survivors, rng_state = last_round
+        last_round = (round_number, json.loads(roster), json.loads(pairings), json.loads(survivors), json.loads(rng_state))
+        fights = conn.execute(SQL_ROUND_FIGHTS, (tournament_id, round_number)).fetchall()
+    return tournament_id, seed, player_rows, last_round, fights
+
+def _load_narration_cache(limit):
+    return _get_connection().execute(SQL_LOAD_NARRATIONS, (limit,)).fetchall()
+
+def _save_narration_cache(entries, evicted_keys):
+    conn = _get_connection()
+    now = time.time()
+    with conn:
+        # Marca temporal creciente para conservar el orden de uso dentro del lote.
+        conn.executemany(SQL_SAVE_NARRATION, [(key, narration, now + i * 1e-6) for i, (key, narration) in enumerate(entries)])
+        conn.executemany(SQL_DELETE_NARRATION, [(key,) for key in evicted_keys])
+
+def _close_db():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+# --- API PÚBLICA ---
+
+async def initialize_db(default_channel_id=0):
+    """Crea las tablas de jugadores, puntos de control y caché de narraciones si no existen.
+
+    Los datos de versiones sin canales se asignan a `default_channel_id`.
+    """
+    await _run(_initialize_db, default_channel_id)
+
+async def add_player_submission(channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id=None):
+    """Añade una nueva solicitud de jugador a la convocatoria de un canal, pendiente de aprobación."""
+    await _run(_add_player_submission, channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id)
+
+async def add_player_submissions(rows):
+    """Añade un lote de solicitudes (channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id) en una sola transacción."""
+    await _run(_add_player_submissions, rows)
+
+async def approve_player(channel_id, user_id, is_champion):
+    """Marca a un jugador como aprobado y asigna su estatus."""
+    await _run(_approve_player, channel_id, user_id, is_champion)
+
+async def approve_players(keys, is_champion):
+    """Aprueba en una sola transacción las solicitudes pendientes (channel_id, user_id) indicadas. Devuelve las aprobadas."""
+    return await _run(_approve_players, list(keys), is_champion)
+
+async def reject_players(keys):
+    """Elimina en una sola transacción varias solicitudes (channel_id, user_id)."""
+    await _run(_reject_players, list(keys))
+
+async def get_pending_players(limit, offset=0, after=None):
+    """Devuelve una página de solicitudes pendientes de todos los canales (channel_id, user_id, user_name, character_name, specialty, evidence_file_id).
+
+    Con `after` (canal, usuario), la página empieza justo después de esa clave en lugar de en `offset`.
+    """
+    return await _run(_get_pending_players, limit, offset, after)
+
+async def count_pending_players():
+    """Cuenta las solicitudes pendientes de aprobación."""
+    return await _run(_count_pending_players)
+
+async def reject_player(channel_id, user_id):
+    """Elimina una solicitud de jugador de la base de datos."""
+    await _run(_reject_player, channel_id, user_id)
+
+async def get_player_info(channel_id, user_id):
+    """Obtiene la información de un jugador específico."""
+    return await _run(_get_player_info, channel_id, user_id)
+
+async def get_approved_players(channel_id):
+    """Devuelve los jugadores aprobados en la convocatoria de un canal."""
+    return await _run(_get_approved_players, channel_id)
+
+async def clear_players(channel_id):
+    """Limpia los jugadores de un canal para un nuevo torneo, sin tocar los de los demás."""
+    await _run(_clear_players, channel_id)
+
+async def player_exists(channel_id, user_id):
+    """Verifica si un jugador (aprobado o no) ya existe en la convocatoria de un canal."""
+    return await _run(_player_exists, channel_id, user_id)
+
+async def get_player_keys():
+    """Devuelve los pares (channel_id, user_id) de todos los jugadores registrados (aprobados o no)."""
+    return await _run(_get_player_keys)
+
+async def create_tournament(channel_id, seed, player_rows):
+    """Registra un torneo nuevo de un canal con una copia de sus jugadores. Devuelve su id."""
+    return await _run(_create_tournament, channel_id, seed, player_rows)
+
+async def get_seed_ratings(tournament_id):
+    """Puntuaciones de los jugadores al empezar el torneo, {user_id: puntuación}."""
+    return await _run(_get_seed_ratings, tournament_id)
+
+async def save_round(tournament_id, round_number, roster, pairings, survivors, rng_state):
+    """Guarda el estado de arranque de una ronda (ids de jugadores y estado del generador aleatorio)."""
+    await _run(_save_round, tournament_id, round_number, roster, pairings, survivors, rng_state)
+
+async def save_fights(fight_rows):
+    """Guarda en una sola transacción un lote de combates terminados y actualiza la puntuación de sus guerreros."""
+    await _run(_save_fights, fight_rows)
+
+async def finish_tournament(tournament_id, winner_id):
+    """Marca un torneo como terminado y suma el título a su campeón."""
+    await _run(_finish_tournament, tournament_id, winner_id)
+
+async def get_leaderboard(limit, offset=0):
+    """Una página de la clasificación (user_id, user_name, character_name, rating, wins, losses, tournaments, titles)."""
+    return await _run(_get_leaderboard, limit, offset)
+
+async def get_profile(user_id=None, user_name=None):
+    """Ficha de un guerrero por id o por nombre de usuario: (fila de la clasificación, puesto), o None."""
+    return await _run(_get_profile, user_id, user_name)
+
+async def get_unfinished_tournament(channel_id):
+    """Devuelve (id, semilla, jugadores, última ronda, combates de esa ronda) del último torneo sin terminar del canal, o None."""
+    return await _run(_get_unfinished_tournament, channel_id)
+
+async def load_narration_cache(limit):
+    """Devuelve las `limit` narraciones usadas más recientemente, de la más antigua a la más nueva."""
+    return await _run(_load_narration_cache, limit)
+
+async def save_narration_cache(entries, evicted_keys):
+    """Guarda o refresca narraciones (clave, texto) y borra las expulsadas, en una sola transacción."""
+    await _run(_save_narration_cache, entries, evicted_keys)
+
+async def close_db():
+    """Cierra la conexión persistente (al apagar el bot)."""
+    await _run(_close_db)
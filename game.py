@@ -1,6 +1,13 @@
 # game.py
+import asyncio
+import json
 import random
-import google.generativeai as genai
+
+import metrics
+from narration import TemplateNarrator, narration_key
+from rating import DEFAULT_RATING
+from roster import Roster
+from status_panel import StatusPanel
 
 ABSURD_SKILLS = [
     "Narcolepsia repentina", "Atraer mariposas en momentos inoportunos", "Bailar polka sin control",
@@ -10,72 +17,117 @@ ABSURD_SKILLS = [
     "Incapacidad para susurrar", "Sudoración de color azul neón"
 ]
 
-class Player:
-    def __init__(self, user_id, user_name, character_name, specialty, absurd_skill, is_champion):
-        self.user_id = user_id
-        self.user_name = user_name
-        self.character_name = character_name
-        self.specialty = specialty
-        self.is_champion = is_champion
-        self.absurd_skill = absurd_skill
+TRIALS = ["el Juicio del Laberinto de Espejos", "la Carga del Minotauro Espectral", "el Duelo Celestial en el Puente Bifrost", "la Furia del Volcán de Sombras"]
 
-    def mention(self):
-        return f"@{self.user_name}" if self.user_name else self.character_name
+# Estimación de tokens de salida por combate en el modo por lotes (≈ 4 frases).
+BATCH_OUTPUT_TOKENS_PER_FIGHT = 160
 
 class Game:
-    def __init__(self, api_key):
+    def __init__(self, api_key, narration_timeout=30, max_concurrent_narrations=4, batch_narration=False, narration_token_budget=4000,
+                 narration_cache=None, failure_threshold=3, template_cooldown=300, narration_slots=None, seeded_pairings=False):
         self.is_running = False
-        self.active_players = []
-        self.eliminated_this_round = []
+        self.is_invocation_open = False
+        self.roster = Roster()
         self.first_round = True
+        self.round_number = 0
+        self.seed = None
+        self.rng = random.Random()
+        self.tournament_id = None
+        # Emparejamientos sembrados: con las puntuaciones Elo congeladas al empezar el torneo
+        # ({user_id: puntuación}), el mejor se enfrenta al peor, el segundo al penúltimo...
+        self.seeded_pairings = seeded_pairings
+        self.ratings = {}
+        # Límite de tiempo y de llamadas simultáneas a Gemini para no saturar la API.
+        # Con varios torneos, `narration_slots` reparte un límite compartido entre todos.
+        self.narration_timeout = narration_timeout
+        self._narration_slots = narration_slots or asyncio.Semaphore(max_concurrent_narrations)
+        # Modo por lotes: una sola petición narra varios combates de la ronda.
+        self.batch_narration = batch_narration
+        self.narration_token_budget = narration_token_budget
+        # Caché persistente y narrador local: tras `failure_threshold` fallos o esperas agotadas
+        # seguidas, las plantillas toman el relevo durante `template_cooldown` segundos.
+        self.narration_cache = narration_cache
+        self.templates = TemplateNarrator()
+        self.failure_threshold = failure_threshold
+        self.template_cooldown = template_cooldown
+        self._consecutive_failures = 0
+        self._templates_until = 0.0
+        # Gemini se carga en segundo plano con warm_up(); hasta entonces narran las plantillas.
+        self.api_key = api_key
+        self.model = None
+
+    def _load_model(self):
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel('gemini-1.5-flash')
+
+    async def warm_up(self):
+        """Importa y configura Gemini en un hilo aparte, sin retrasar el arranque del bot."""
+        if not self.api_key or self.model is not None:
+            return
         try:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = await asyncio.to_thread(self._load_model)
         except Exception as e:
             print(f"Error al configurar Gemini: {e}")
-            self.model = None
-
-    def load_players(self, player_rows):
-        """Carga los jugadores desde la base de datos al inicio del juego."""
-        self.active_players = []
-        for row in player_rows:
-            # Tupla de la DB: (user_id, user_name, character_name, specialty, absurd_skill, is_champion, is_approved)
-            player = Player(row[0], row[1], row[2], row[3], row[4], row[5])
-            self.active_players.append(player)
-        random.shuffle(self.active_players)
+
+    @property
+    def active_players(self):
+        """Guerreros en pie, en el orden de la ronda."""
+        return self.roster.active
+
+    @active_players.setter
+    def active_players(self, players):
+        self.roster.set_active(players)
+
+    def load_players(self, player_rows, seed=None):
+        """Carga los jugadores desde la base de datos al inicio del juego.
+
+        Con la misma semilla y los mismos jugadores, el torneo se repite combate a combate.
+        """
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.rng = random.Random(self.seed)
+        self.round_number = 0
+        # Tupla de la DB: (user_id, user_name, character_name, specialty, absurd_skill, is_champion, is_approved)
+        self.roster.load(player_rows)
+        self.rng.shuffle(self.roster.active)
         self.is_running = True
         self.first_round = True
 
+    def restore(self, tournament_id, seed, player_rows, last_round, fight_rows):
+        """Reconstruye un torneo interrumpido a partir de su último punto de control.
+
+        Devuelve (panel, emparejamientos, supervivientes, ganadores ya decididos por
+        índice de combate) de la ronda en curso, o None si no llegó a empezar ninguna.
+        """
+        self.load_players(player_rows, seed=seed)
+        self.tournament_id = tournament_id
+        if last_round is None:
+            return None
+
+        round_number, roster, pairing_ids, survivor_ids, rng_state = last_round
+        by_id = self.roster.by_id
+        self.roster.restore_active(roster)
+        self.round_number = round_number
+        self.first_round = False
+        self.rng.setstate((rng_state[0], tuple(rng_state[1]), rng_state[2]))
+
+        panel = StatusPanel(self.active_players)
+        pairings = [(by_id[id1], by_id[id2]) for id1, id2 in pairing_ids]
+        survivors = [by_id[user_id] for user_id in survivor_ids]
+        winners = {}
+        for fight_index, winner_id, loser_id, _ in fight_rows:
+            winners[fight_index] = by_id[winner_id]
+            panel.eliminate(by_id[loser_id])
+        return panel, pairings, survivors, winners
+
     def start_new_round(self):
-        """Prepara el texto del panel de estado para una nueva ronda."""
-        self.eliminated_this_round = []
-        all_players_this_round = sorted(self.active_players, key=lambda p: p.character_name)
-        
-        header = f"--- **RONDA CON {len(all_players_this_round)} GUERREROS** ---\n\n"
-        player_lines = []
-        for player in all_players_this_round:
-            title = "👑" if player.is_champion else "🔥"
-            player_lines.append(f"• {title} {player.character_name} ({player.mention()})")
-        
-        return header + "\n".join(player_lines)
+        """Prepara el panel de estado para una nueva ronda."""
+        self.round_number += 1
+        return StatusPanel(self.active_players)
 
-    def update_status_text(self, original_text, loser):
-        """Actualiza el texto del panel de estado tachando al perdedor."""
-        self.eliminated_this_round.append(loser)
-        
-        lines = original_text.split('\n')
-        header = lines[0]
-        player_lines = lines[2:] # Omitir header y línea en blanco
-
-        new_player_lines = []
-        for line in player_lines:
-            is_eliminated = any(eliminated.character_name in line for eliminated in self.eliminated_this_round)
-            if is_eliminated and not line.startswith("• ~"):
-                new_player_lines.append(f"• ~{line[2:]}~ (Eliminado)")
-            else:
-                new_player_lines.append(line)
-        
-        return f"{header}\n\n" + "\n".join(new_player_lines)
+    def advance_round(self, survivors, winners):
+        """Pasa a la siguiente ronda con los que avanzaron directamente y los ganadores, en O(n)."""
+        self.roster.set_active(survivors + winners)
 
     def play_next_round_pairings(self):
         """Genera los emparejamientos y supervivientes para la ronda."""
@@ -86,7 +138,7 @@ class Game:
         survivors = []
         
         round_players = self.active_players[:]
-        random.shuffle(round_players)
+        self.rng.shuffle(round_players)
 
         if self.first_round:
             self.first_round = False
@@ -95,49 +147,276 @@ class Game:
             survivors.extend(champions)
             round_players = aspirants
 
+        if self.seeded_pairings and self.ratings:
+            # Orden estable: el barajado previo solo decide los empates (y mantiene el estado del rng).
+            round_players.sort(key=lambda p: self.ratings.get(p.user_id, DEFAULT_RATING))
+
         if len(round_players) % 2 != 0:
             survivors.append(round_players.pop())
 
+        if self.seeded_pairings and self.ratings:
+            half = len(round_players) // 2
+            pairings.extend(zip(reversed(round_players[half:]), round_players[:half]))
+            return pairings, survivors
+
         while round_players:
             pairings.append((round_players.pop(), round_players.pop()))
             
         return pairings, survivors
 
-    def simulate_combat(self, player1, player2):
-        """Genera la narración de un combate y determina ganador/perdedor."""
-        if not self.model:
-            winner, loser = random.choice([(player1, player2), (player2, player1)])
-            fallback = f"⚡ ¡Una energía divina ciega la arena! Cuando la luz se disipa, **{winner.character_name}** sigue en pie. ¡Ha ganado!"
-            return fallback, winner, loser
+    def decide_combat(self, player1, player2):
+        """Decide ganador, perdedor y prueba antes de narrar, de forma reproducible a partir de la semilla."""
+        low, high = sorted((player1, player2), key=lambda p: p.user_id)
+        fight_rng = random.Random(f"{self.seed}:{self.round_number}:{low.user_id}:{high.user_id}")
+        trial = fight_rng.choice(TRIALS)
+        winner, loser = fight_rng.choice([(low, high), (high, low)])
+        return winner, loser, trial
+
+    def template_combat(self, player1, player2):
+        """Narración local por plantillas cuando Gemini no está disponible, falla o tarda demasiado."""
+        winner, loser, trial = self.decide_combat(player1, player2)
+        key = narration_key(self.seed, player1, player2, trial, winner)
+        metrics.inc("narrations_total", source="template")
+        return self.templates.narrate(player1, player2, winner, loser, trial, key), winner, loser
+
+    def _gemini_available(self):
+        return self.model is not None and asyncio.get_running_loop().time() >= self._templates_until
+
+    def _record_gemini_success(self):
+        self._consecutive_failures = 0
+
+    def _record_gemini_failure(self):
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failure_threshold:
+            print(f"Gemini falla de forma continuada: se usa el narrador local durante {self.template_cooldown}s.")
+            self._templates_until = asyncio.get_running_loop().time() + self.template_cooldown
+            self._consecutive_failures = 0
+
+    def _cached(self, key):
+        return self.narration_cache.get(key) if self.narration_cache else None
+
+    def _remember(self, key, narration):
+        if self.narration_cache:
+            self.narration_cache.put(key, narration)
 
-        trials = ["el Juicio del Laberinto de Espejos", "la Carga del Minotauro Espectral", "el Duelo Celestial en el Puente Bifrost", "la Furia del Volcán de Sombras"]
-        trial = random.choice(trials)
+    async def simulate_combat(self, player1, player2):
+        """Narra un combate cuyo resultado ya está decidido, sin bloquear el bucle de eventos."""
+        winner, loser, trial = self.decide_combat(player1, player2)
+        key = narration_key(self.seed, player1, player2, trial, winner)
+        cached = self._cached(key)
+        if cached is not None:
+            metrics.inc("narrations_total", source="cache")
+            return cached, winner, loser
+        if not self._gemini_available():
+            metrics.inc("gemini_fallbacks_total", reason="circuit_open" if self.model else "no_model")
+            return self.template_combat(player1, player2)
 
         prompt = (f"Actúa como narrador épico del Coliseo de Kai. Narra un combate a muerte en un párrafo corto y conciso (máximo 4 frases). La prueba es: '{trial}'.\n"
                   f"Combatientes:\n- '{player1.character_name}' (@{player1.user_name}), dominio '{player1.specialty}', habilidad extraña '{player1.absurd_skill}'.\n"
                   f"- '{player2.character_name}' (@{player2.user_name}), dominio '{player2.specialty}', habilidad extraña '{player2.absurd_skill}'.\n\n"
-                  f"Incorpora de forma humorística cómo sus inútiles habilidades afectan el combate. La narración debe ser rápida y directa. Concluye declarando inequívocamente al ganador.")
+                  f"El vencedor de este combate es '{winner.character_name}'.\n"
+                  f"Incorpora de forma humorística cómo sus inútiles habilidades afectan el combate. La narración debe ser rápida y directa. Concluye declarando inequívocamente a '{winner.character_name}' como ganador.")
         
         try:
-            response = self.model.generate_content(prompt)
+            # La cancelación de la tarea se propaga a la petición en curso.
+            async with self._narration_slots:
+                with metrics.timer("gemini_request_seconds", mode="single"):
+                    response = await asyncio.wait_for(self.model.generate_content_async(prompt), timeout=self.narration_timeout)
             text_response = response.text
-            # Lógica robusta para determinar ganador
-            if player1.character_name.lower() in text_response and player2.character_name.lower() not in text_response:
-                winner, loser = player1, player2
-            elif player2.character_name.lower() in text_response and player1.character_name.lower() not in text_response:
-                winner, loser = player2, player1
-            else: # Si ambos son mencionados, o ninguno, decidir al azar
-                winner, loser = random.choice([(player1, player2), (player2, player1)])
-            
-            return text_response, winner, loser
-
+        except asyncio.TimeoutError:
+            print(f"Tiempo agotado ({self.narration_timeout}s) esperando a Gemini.")
+            metrics.inc("gemini_fallbacks_total", reason="timeout")
+            self._record_gemini_failure()
+            return self.template_combat(player1, player2)
         except Exception as e:
             print(f"Error en la llamada a la API de Gemini: {e}")
-            winner, loser = random.choice([(player1, player2), (player2, player1)])
-            fallback = f"⚡ ¡Una energía divina ciega la arena! Cuando la luz se disipa, **{winner.character_name}** sigue en pie. ¡Ha ganado!"
-            return fallback, winner, loser
+            metrics.inc("gemini_fallbacks_total", reason="error")
+            self._record_gemini_failure()
+            return self.template_combat(player1, player2)
+
+        self._record_gemini_success()
+        metrics.inc("narrations_total", source="gemini")
+        self._remember(key, text_response)
+        return text_response, winner, loser
+
+    def _batch_entry(self, number, player1, player2, trial, winner):
+        """Descripción de un combate dentro de una petición por lotes."""
+        return (f"Combate {number} — prueba: '{trial}'. Vencedor: '{winner.character_name}'.\n"
+                f"- '{player1.character_name}' (@{player1.user_name}), dominio '{player1.specialty}', habilidad extraña '{player1.absurd_skill}'.\n"
+                f"- '{player2.character_name}' (@{player2.user_name}), dominio '{player2.specialty}', habilidad extraña '{player2.absurd_skill}'.\n")
+
+    def chunk_pairings(self, pairings):
+        """Agrupa los emparejamientos en lotes que caben en el presupuesto de tokens."""
+        chunks = []
+        current = []
+        used = 0
+        for player1, player2 in pairings:
+            # ~4 caracteres por token para la entrada, más la narración esperada.
+            cost = len(self._batch_entry(0, player1, player2, TRIALS[0], player1)) // 4 + BATCH_OUTPUT_TOKENS_PER_FIGHT
+            if current and used + cost > self.narration_token_budget:
+                chunks.append(current)
+                current = []
+                used = 0
+            current.append((player1, player2))
+            used += cost
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def narrate_batch(self, pairings):
+        """Narra varios combates en una sola llamada a Gemini.
+
+        Los resultados se deciden antes de la llamada. Devuelve una lista alineada
+        con `pairings`; las entradas que falten o no sean válidas quedan a None
+        para narrarlas después una a una.
+        """
+        results = [None] * len(pairings)
+        decisions = [self.decide_combat(p1, p2) for p1, p2 in pairings]
+        keys = [narration_key(self.seed, p1, p2, trial, winner) for (p1, p2), (winner, _, trial) in zip(pairings, decisions)]
+        uncached = []
+        for index, key in enumerate(keys):
+            cached = self._cached(key)
+            if cached is not None:
+                winner, loser, _ = decisions[index]
+                results[index] = (cached, winner, loser)
+                metrics.inc("narrations_total", source="cache")
+            else:
+                uncached.append(index)
+        if not uncached or not self._gemini_available():
+            return results
+
+        # Los combates se numeran dentro de la petición, solo con los que no estaban en caché.
+        fights = "\n".join(self._batch_entry(n, pairings[index][0], pairings[index][1], decisions[index][2], decisions[index][0])
+                           for n, index in enumerate(uncached, start=1))
+        prompt = (f"Actúa como narrador épico del Coliseo de Kai. Narra cada uno de los siguientes combates a muerte en un párrafo corto y conciso (máximo 4 frases por combate).\n"
+                  f"Incorpora de forma humorística cómo sus inútiles habilidades afectan el combate. La narración debe ser rápida y directa y concluir declarando inequívocamente al vencedor indicado.\n"
+                  f"Responde ÚNICAMENTE con un array JSON con un objeto por combate: "
+                  f'{{"combate": <número>, "narracion": "<texto>"}}.\n\n'
+                  f"{fights}")
+
+        try:
+            async with self._narration_slots:
+                with metrics.timer("gemini_request_seconds", mode="batch"):
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(prompt, generation_config={"response_mime_type": "application/json"}),
+                        timeout=self.narration_timeout)
+            entries = json.loads(response.text)
+        except asyncio.TimeoutError:
+            print(f"Tiempo agotado ({self.narration_timeout}s) esperando a Gemini (lote de {len(uncached)}).")
+            metrics.inc("gemini_fallbacks_total", reason="batch_timeout")
+            self._record_gemini_failure()
+            return results
+        except Exception as e:
+            print(f"Error en la narración por lotes: {e}")
+            metrics.inc("gemini_fallbacks_total", reason="batch_error")
+            self._record_gemini_failure()
+            return results
+
+        self._record_gemini_success()
+        if not isinstance(entries, list):
+            return results
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            number, text = entry.get("combate"), entry.get("narracion")
+            if not isinstance(number, int) or not 1 <= number <= len(uncached):
+                continue
+            if not isinstance(text, str) or not text.strip():
+                continue
+            index = uncached[number - 1]
+            winner, loser, _ = decisions[index]
+            results[index] = (text, winner, loser)
+            self._remember(keys[index], text)
+            metrics.inc("narrations_total", source="gemini")
+        return results
 
     def end_game(self):
         """Resetea el estado del juego."""
         self.is_running = False
-        self.active_players = []
\ No newline at end of file
+        self.roster.clear()
+        self.tournament_id = None
+        self.ratings = {}
+
+def simulate_bracket(player_count, seed=0, champion_every=20):
+    """Simula en memoria un cuadro completo sin narración, para pruebas de carga.
+
+    Devuelve (ganador, número de combates).
+    """
+    game = Game(None)
+    rows = ((user_id, f"guerrero{user_id}", f"Guerrero {user_id}", "Dominio", ABSURD_SKILLS[user_id % len(ABSURD_SKILLS)],
+             user_id % champion_every == 0) for user_id in range(1, player_count + 1))
+    game.load_players(rows, seed=seed)
+    fights = 0
+    while len(game.active_players) > 1:
+        game.round_number += 1
+        pairings, survivors = game.play_next_round_pairings()
+        winners = [game.decide_combat(player1, player2)[0] for player1, player2 in pairings]
+        fights += len(pairings)
+        game.advance_round(survivors, winners)
+    return game.active_players[0], fights
+
+class CombatPrefetcher:
+    """Narra por adelantado los próximos combates de una ronda mientras corren las cuentas atrás."""
+    def __init__(self, game, pairings, depth):
+        self.game = game
+        self.pairings = list(pairings)
+        self.depth = max(depth, 0)
+        # Cada lote es un rango [inicio, fin) de emparejamientos narrado con una sola tarea.
+        if game.batch_narration:
+            self._chunks = []
+            start = 0
+            for chunk in game.chunk_pairings(self.pairings):
+                self._chunks.append((start, start + len(chunk)))
+                start += len(chunk)
+        else:
+            self._chunks = [(i, i + 1) for i in range(len(self.pairings))]
+        self._chunk_of = {}
+        for chunk_index, (start, end) in enumerate(self._chunks):
+            for index in range(start, end):
+                self._chunk_of[index] = chunk_index
+        self._tasks = {}
+        self._next_chunk = 0
+
+    async def _narrate_chunk(self, start, end):
+        if self.game.batch_narration:
+            return await self.game.narrate_batch(self.pairings[start:end])
+        player1, player2 = self.pairings[start]
+        return [await self.game.simulate_combat(player1, player2)]
+
+    def _fill(self, index):
+        """Lanza las narraciones pendientes hasta `depth` combates por delante de `index`."""
+        while self._next_chunk < len(self._chunks) and self._chunks[self._next_chunk][0] <= index + self.depth:
+            start, end = self._chunks[self._next_chunk]
+            self._tasks[self._next_chunk] = asyncio.create_task(self._narrate_chunk(start, end))
+            self._next_chunk += 1
+
+    def start(self):
+        """Empieza a narrar los primeros combates de la ronda."""
+        self._fill(0)
+
+    async def result(self, index):
+        """Devuelve (narración, ganador, perdedor) del combate `index`, usando el texto de emergencia si falló."""
+        self._fill(index)
+        chunk_index = self._chunk_of[index]
+        task = self._tasks[chunk_index]
+        start, end = self._chunks[chunk_index]
+        if index == end - 1:
+            del self._tasks[chunk_index]
+        # Mientras se publica este combate y corre la pausa, ya se narra el siguiente tramo.
+        self._fill(index + 1)
+        player1, player2 = self.pairings[index]
+        try:
+            entry = (await task)[index - start]
+        except Exception as e:
+            print(f"Error en la narración anticipada: {e}")
+            return self.game.template_combat(player1, player2)
+        if entry is None:
+            # Entrada ausente o mal formada en el lote (o Gemini en pausa): se narra este combate por separado.
+            return await self.game.simulate_combat(player1, player2)
+        return entry
+
+    def cancel(self):
+        """Cancela las narraciones que ya no se van a usar."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
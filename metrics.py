@@ -0,0 +1,175 @@
+# metrics.py
+import asyncio
+import bisect
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+# Límites superiores (segundos) de los cubos de los histogramas: desde consultas de
+# SQLite de milisegundos hasta rondas de torneo de horas.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 7200)
+
+HELP = {
+    "handler_seconds": "Duración de los manejadores de Telegram.",
+    "tournament_phase_seconds": "Duración de las fases del torneo.",
+    "gemini_request_seconds": "Latencia de las peticiones a Gemini.",
+    "narrations_total": "Narraciones servidas, por origen (cache, gemini, template).",
+    "gemini_fallbacks_total": "Narraciones que no pudieron pedirse a Gemini, por motivo.",
+    "db_query_seconds": "Duración de las operaciones de SQLite, incluida la espera en cola.",
+    "telegram_request_seconds": "Latencia de las llamadas salientes a la API de Telegram.",
+    "telegram_errors_total": "Errores de las llamadas salientes a la API de Telegram, por tipo.",
+}
+
+# (nombre, etiquetas) -> [recuentos por cubo (el último es +Inf), suma, total]
+_histograms = {}
+# (nombre, etiquetas) -> valor
+_counters = {}
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    """Registra una duración en el histograma `name`."""
+    key = (name, _labels_key(labels))
+    entry = _histograms.get(key)
+    if entry is None:
+        entry = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+    entry[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+    entry[1] += seconds
+    entry[2] += 1
+
+def inc(name, amount=1, **labels):
+    """Incrementa el contador `name`."""
+    key = (name, _labels_key(labels))
+    _counters[key] = _counters.get(key, 0) + amount
+
+@contextmanager
+def timer(name, **labels):
+    """Mide el bloque `with` (también si lanza una excepción) y lo registra en `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def handler(func):
+    """Decorador: mide la duración de un manejador asíncrono en handler_seconds."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timer("handler_seconds", handler=func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+def reset():
+    """Vacía todas las métricas."""
+    _histograms.clear()
+    _counters.clear()
+
+def quantile(counts, total, q):
+    """Estima un cuantil a partir de los cubos, interpolando dentro del cubo que lo contiene."""
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if index == len(BUCKETS):
+                return BUCKETS[-1]
+            low = BUCKETS[index - 1] if index else 0.0
+            return low + (BUCKETS[index] - low) * (rank - seen) / count
+        seen += count
+    return BUCKETS[-1]
+
+def histogram(name, **labels):
+    """(recuentos por cubo, suma, total) de un histograma, o None si no tiene datos."""
+    return _histograms.get((name, _labels_key(labels)))
+
+def counter_total(name, **labels):
+    """Suma de un contador sobre todas las combinaciones de etiquetas que incluyen `labels`."""
+    wanted = set(labels.items())
+    return sum(value for (counter, key), value in _counters.items() if counter == name and wanted <= set(key))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in pairs) + "}"
+
+def render_prometheus():
+    """Todas las métricas en el formato de texto de Prometheus."""
+    lines = []
+    for name in sorted({name for name, _ in _histograms}):
+        lines.append(f"# HELP coliseo_{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE coliseo_{name} histogram")
+        for (histogram, key), (counts, total_sum, total) in sorted(_histograms.items()):
+            if histogram != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"coliseo_{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"coliseo_{name}_sum{_format_labels(key)} {total_sum:.6f}")
+            lines.append(f"coliseo_{name}_count{_format_labels(key)} {total}")
+    for name in sorted({name for name, _ in _counters}):
+        lines.append(f"# HELP coliseo_{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE coliseo_{name} counter")
+        for (counter, key), value in sorted(_counters.items()):
+            if counter == name:
+                lines.append(f"coliseo_{name}{_format_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+def summary_lines():
+    """Resumen legible para /stats: recuento, p50, p99 y media de cada histograma, y los contadores."""
+    lines = []
+    for (name, key), (counts, total_sum, total) in sorted(_histograms.items()):
+        labels = ",".join(str(label_value) for _, label_value in key)
+        lines.append(f"{name}[{labels}] n={total} p50={quantile(counts, total, 0.5):.3f}s "
+                     f"p99={quantile(counts, total, 0.99):.3f}s media={total_sum / total:.3f}s")
+    for (name, key), value in sorted(_counters.items()):
+        labels = ",".join(str(label_value) for _, label_value in key)
+        lines.append(f"{name}[{labels}] = {value}")
+    narrations = counter_total("narrations_total")
+    if narrations:
+        rate = counter_total("narrations_total", source="template") / narrations
+        lines.append(f"Tasa de narraciones por plantilla: {rate:.1%} de {narrations}")
+    return lines or ["Todavía no hay métricas."]
+
+class PrometheusFileWriter:
+    """Vuelca periódicamente las métricas en un fichero de texto (recolector textfile de node_exporter)."""
+    def __init__(self, path, interval=15.0):
+        self.path = path
+        self.interval = interval
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el volcado, escribiendo una última vez."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.write()
+
+    def write(self):
+        # Se escribe en un temporal y se renombra para que nunca se lea un fichero a medias.
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(render_prometheus())
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Error al escribir las métricas: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.write()
@@ -0,0 +1,114 @@
+# narration.py
+import asyncio
+import random
+from collections import OrderedDict
+
+import database
+
+# --- NARRADOR LOCAL POR PLANTILLAS (sin Gemini) ---
+
+OPENINGS = [
+    "En {trial}, **{p1}** y **{p2}** se miden bajo la mirada de Kai.",
+    "Las puertas se abren y {trial} engulle a **{p1}** y **{p2}**.",
+    "El público enmudece: {trial} acaba de comenzar entre **{p1}** y **{p2}**.",
+    "Kai chasquea los dedos y **{p1}** y **{p2}** aparecen en {trial}.",
+    "Retumban los tambores del Coliseo: {trial} enfrenta a **{p1}** contra **{p2}**.",
+]
+
+MOVES = [
+    "**{name}** despliega su dominio de {specialty}, pero su maldición ({skill}) lo deja en ridículo.",
+    "**{name}** intenta imponer su {specialty} justo cuando «{skill}» decide manifestarse.",
+    "Con toda la fuerza de su {specialty}, **{name}** carga... y «{skill}» convierte el ataque en un espectáculo.",
+    "**{name}** confía en su {specialty}, aunque «{skill}» le roba toda la dignidad.",
+    "Entre fintas de {specialty}, **{name}** sufre un ataque de «{skill}» en el peor momento.",
+]
+
+ENDINGS = [
+    "Cuando el polvo se asienta, solo **{winner}** sigue en pie. ¡Ha ganado!",
+    "Un último golpe y **{loser}** cae. ¡**{winner}** es el vencedor!",
+    "⚡ ¡Una energía divina ciega la arena! Cuando la luz se disipa, **{winner}** sigue en pie. ¡Ha ganado!",
+    "Kai levanta la mano: **{winner}** triunfa y **{loser}** es devuelto al polvo.",
+    "La arena ruge el nombre de **{winner}**, vencedor indiscutible del combate.",
+]
+
+class TemplateNarrator:
+    """Combina dominio, habilidad absurda y prueba en una narración variada, en microsegundos."""
+    def narrate(self, player1, player2, winner, loser, trial, key):
+        rng = random.Random(key)
+        lines = [rng.choice(OPENINGS).format(trial=trial, p1=player1.character_name, p2=player2.character_name)]
+        for player, move in zip((player1, player2), rng.sample(MOVES, 2)):
+            lines.append(move.format(name=player.character_name, specialty=player.specialty, skill=player.absurd_skill))
+        lines.append(rng.choice(ENDINGS).format(winner=winner.character_name, loser=loser.character_name))
+        return " ".join(lines)
+
+# --- CACHÉ PERSISTENTE DE NARRACIONES ---
+
+def narration_key(seed, player1, player2, trial, winner):
+    """Clave de caché de un combate: semilla, pareja, prueba y vencedor."""
+    low, high = sorted((player1, player2), key=lambda p: p.user_id)
+    return f"{seed}|{low.user_id}:{low.character_name}|{high.user_id}:{high.character_name}|{trial}|{winner.user_id}"
+
+class NarrationCache:
+    """Caché LRU de narraciones en memoria, respaldada por SQLite para sobrevivir a reinicios."""
+    def __init__(self, capacity=5000, flush_interval=5.0):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._dirty = {}
+        self._evicted = set()
+        self._worker = None
+
+    async def start(self):
+        """Carga las entradas más recientes y arranca el volcado periódico a SQLite."""
+        for key, narration in await database.load_narration_cache(self.capacity):
+            self._entries[key] = narration
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el volcado periódico, guardando lo pendiente."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
+
+    def get(self, key):
+        """Devuelve la narración guardada (o None) y la marca como usada recientemente."""
+        narration = self._entries.get(key)
+        if narration is not None:
+            self._entries.move_to_end(key)
+            self._dirty.pop(key, None)
+            self._dirty[key] = narration
+        return narration
+
+    def put(self, key, narration):
+        """Guarda una narración, expulsando la menos usada si se supera la capacidad."""
+        self._entries[key] = narration
+        self._entries.move_to_end(key)
+        self._dirty.pop(key, None)
+        self._dirty[key] = narration
+        self._evicted.discard(key)
+        while len(self._entries) > self.capacity:
+            old_key, _ = self._entries.popitem(last=False)
+            self._dirty.pop(old_key, None)
+            self._evicted.add(old_key)
+
+    async def flush(self):
+        """Escribe los cambios pendientes en una sola transacción."""
+        if not self._dirty and not self._evicted:
+            return
+        # El orden de inserción respeta el de uso, así que last_used crece con él.
+        dirty, self._dirty = list(self._dirty.items()), {}
+        evicted, self._evicted = list(self._evicted), set()
+        try:
+            await database.save_narration_cache(dirty, evicted)
+        except Exception as e:
+            print(f"Error al guardar la caché de narraciones: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
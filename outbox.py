@@ -0,0 +1,212 @@
+# outbox.py
+import asyncio
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import metrics
+
+MAX_MESSAGE_LENGTH = 4096
+
+def message_length(text):
+    """Longitud tal como la cuenta Telegram (unidades UTF-16: los emojis valen 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+def split_lines(lines, limit=MAX_MESSAGE_LENGTH):
+    """Agrupa líneas en textos que no superan el límite de longitud de Telegram."""
+    texts = []
+    current = []
+    size = 0
+    for line in lines:
+        if current and size + message_length(line) + 1 > limit:
+            texts.append("\n".join(current))
+            current = []
+            size = 0
+        current.append(line)
+        size += message_length(line) + 1
+    if current:
+        texts.append("\n".join(current))
+    return texts
+
+class Outbox:
+    """Cola central de mensajes salientes con limitador token-bucket.
+
+    Los envíos se sirven en orden. Las ediciones pendientes de un mismo mensaje
+    se fusionan: solo se envía el texto más reciente. Con `shared_limiter`, cada
+    mensaje además espera su turno en el límite global del bot, repartido entre colas.
+    Los cortes de red (TimedOut, NetworkError) se reintentan hasta `network_retries`
+    veces, duplicando la espera desde `network_backoff` segundos.
+    """
+    def __init__(self, chat_id=None, messages_per_minute=20, burst=3, shared_limiter=None, network_retries=3, network_backoff=1.0):
+        self.chat_id = chat_id
+        self.shared_limiter = shared_limiter
+        self.network_retries = network_retries
+        self.network_backoff = network_backoff
+        self.rate = messages_per_minute / 60
+        self.burst = burst
+        self._bot = None
+        self._queue = deque()
+        self._pending_edits = {}
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker = None
+        self._tokens = burst
+        self._last_refill = None
+
+    def start(self, bot):
+        """Arranca el despachador en segundo plano."""
+        self._bot = bot
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el despachador; los envíos que no salieron fallan con CancelledError."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for op in self._queue:
+            if op[0] == "send" and not op[1].done():
+                op[1].cancel()
+        self._queue.clear()
+        self._pending_edits.clear()
+        self._idle.set()
+
+    def send(self, text, chat_id=None, **kwargs):
+        """Encola un mensaje nuevo. Devuelve un futuro con el `Message` enviado."""
+        future = asyncio.get_running_loop().create_future()
+        kwargs.update(chat_id=chat_id if chat_id is not None else self.chat_id, text=text)
+        self._push(("send", future, kwargs, "send_message", 1))
+        return future
+
+    def call(self, method, cost=1, **kwargs):
+        """Encola cualquier otro método del bot (`send_media_group`, ...). `cost` son los mensajes que cuenta el límite."""
+        future = asyncio.get_running_loop().create_future()
+        kwargs.setdefault("chat_id", self.chat_id)
+        self._push(("send", future, kwargs, method, cost))
+        return future
+
+    def pin(self, message):
+        """Encola el anclado silencioso de un mensaje."""
+        return self.call("pin_chat_message", chat_id=message.chat_id, message_id=message.message_id, disable_notification=True)
+
+    def unpin(self, message):
+        """Encola el desanclado de un mensaje."""
+        return self.call("unpin_chat_message", chat_id=message.chat_id, message_id=message.message_id)
+
+    def edit(self, message, text, **kwargs):
+        """Encola la edición de un mensaje, sustituyendo cualquier edición pendiente del mismo."""
+        key = (message.chat_id, message.message_id)
+        if key not in self._pending_edits:
+            self._push(("edit", key))
+        self._pending_edits[key] = (text, kwargs)
+
+    async def drain(self):
+        """Espera a que la cola quede vacía."""
+        await self._idle.wait()
+
+    def _push(self, op):
+        self._queue.append(op)
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def _acquire(self, cost=1):
+        # Una operación más cara que la ráfaga deja el cubo en negativo y frena las siguientes.
+        needed = min(cost, self.burst)
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._last_refill is not None:
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens >= needed:
+                self._tokens -= cost
+                break
+            await asyncio.sleep((needed - self._tokens) / self.rate)
+        if self.shared_limiter:
+            await self.shared_limiter.acquire(self.chat_id if self.chat_id is not None else id(self), cost)
+
+    async def _call(self, op):
+        if op[0] == "send":
+            with metrics.timer("telegram_request_seconds", method=op[3]):
+                return await getattr(self._bot, op[3])(**op[2])
+        chat_id, message_id = op[1]
+        text, kwargs = self._pending_edits.pop(op[1])
+        try:
+            with metrics.timer("telegram_request_seconds", method="edit_message_text"):
+                return await self._bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, **kwargs)
+        except BadRequest:
+            raise
+        except (RetryAfter, NetworkError):
+            # Se reintentará con el texto más reciente disponible.
+            self._pending_edits.setdefault(op[1], (text, kwargs))
+            raise
+
+    def _fail(self, future, error):
+        print(f"Error al enviar mensaje: {error}")
+        if not future.done():
+            future.set_exception(error)
+            # Evita el aviso de excepción no recuperada si nadie espera el envío.
+            future.add_done_callback(lambda f: f.exception())
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            op = self._queue.popleft()
+            if op[0] == "send" and op[1].cancelled():
+                continue
+            if op[0] == "edit" and op[1] not in self._pending_edits:
+                # Ya se envió con un reintento anterior.
+                continue
+            attempt = 0
+            while True:
+                await self._acquire(op[4] if op[0] == "send" else 1)
+                method = op[3] if op[0] == "send" else "edit_message_text"
+                try:
+                    result = await self._call(op)
+                except RetryAfter as e:
+                    metrics.inc("telegram_errors_total", method=method, error="RetryAfter")
+                    retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                    print(f"Límite de Telegram alcanzado, reintentando en {retry_after}s.")
+                    self._tokens = 0
+                    await asyncio.sleep(retry_after)
+                    continue
+                except BadRequest as e:
+                    # BadRequest hereda de NetworkError, pero reintentarla no cambia nada.
+                    if "not modified" not in str(e):
+                        metrics.inc("telegram_errors_total", method=method, error="BadRequest")
+                    if op[0] == "send":
+                        self._fail(op[1], e)
+                    elif "not modified" not in str(e):
+                        print(f"Error al editar mensaje: {e}")
+                except NetworkError as e:
+                    metrics.inc("telegram_errors_total", method=method, error=type(e).__name__)
+                    if attempt < self.network_retries:
+                        delay = self.network_backoff * 2 ** attempt
+                        attempt += 1
+                        print(f"Error de red al llamar a Telegram ({e}), reintento {attempt} en {delay}s.")
+                        await asyncio.sleep(delay)
+                        continue
+                    if op[0] == "send":
+                        self._fail(op[1], e)
+                    else:
+                        self._pending_edits.pop(op[1], None)
+                        print(f"Error al editar mensaje: {e}")
+                except Exception as e:
+                    metrics.inc("telegram_errors_total", method=method, error=type(e).__name__)
+                    if op[0] == "send":
+                        self._fail(op[1], e)
+                    else:
+                        print(f"Error al editar mensaje: {e}")
+                else:
+                    if op[0] == "send" and not op[1].done():
+                        op[1].set_result(result)
+                break
@@ -0,0 +1,14 @@
+# rating.py
+# Puntuación Elo de los guerreros, acumulada de torneo en torneo.
+
+DEFAULT_RATING = 1500.0
+ELO_K = 32
+
+def expected_score(rating, opponent_rating):
+    """Probabilidad de victoria esperada frente a un rival, según Elo."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+def elo_update(winner_rating, loser_rating, k=ELO_K):
+    """Nuevas puntuaciones (ganador, perdedor) tras un combate."""
+    delta = k * (1 - expected_score(winner_rating, loser_rating))
+    return winner_rating + delta, loser_rating - delta
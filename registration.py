@@ -0,0 +1,84 @@
+# registration.py
+import asyncio
+
+import database
+
+class RegistrationIngestor:
+    """Recibe las inscripciones (comando o WebApp) y las escribe en SQLite por lotes.
+
+    Los duplicados se detectan con un índice en memoria de los pares (canal, usuario)
+    conocidos, sin consultar la base de datos en cada solicitud.
+    """
+    def __init__(self, interval=0.02, on_flush=None):
+        self.interval = interval
+        # Corrutina opcional que se lanza tras guardar cada lote (p. ej. para avisar al admin).
+        self.on_flush = on_flush
+        self._known = set()
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    async def start(self):
+        """Carga el índice de jugadores conocidos y arranca el escritor por lotes."""
+        self._known = set(await database.get_player_keys())
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el escritor, guardando lo que quede pendiente."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self._flush()
+
+    def is_known(self, channel_id, user_id):
+        """Indica si el usuario ya tiene una solicitud en proceso o ha sido aceptado en la convocatoria del canal."""
+        return (channel_id, user_id) in self._known
+
+    def forget(self, channel_id, user_id):
+        """Olvida a un usuario rechazado para que pueda volver a inscribirse."""
+        self._known.discard((channel_id, user_id))
+
+    def reset(self, channel_id):
+        """Vacía el índice de un canal al abrir en él una nueva convocatoria."""
+        self._known = {key for key in self._known if key[0] != channel_id}
+
+    def submit(self, channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id=None):
+        """Encola una solicitud. Devuelve un futuro que se resuelve cuando su lote queda guardado."""
+        self._known.add((channel_id, user_id))
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((channel_id, user_id, user_name, character_name, specialty, absurd_skill, evidence_file_id), future))
+        self._wakeup.set()
+        return future
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await database.add_player_submissions([row for row, _ in batch])
+        except Exception as e:
+            for row, future in batch:
+                self._known.discard(row[:2])
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        if self.on_flush:
+            try:
+                await self.on_flush(len(batch))
+            except Exception as e:
+                print(f"Error tras guardar un lote de inscripciones: {e}")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Deja que se acumulen las solicitudes que llegan casi a la vez.
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            await self._flush()
@@ -0,0 +1,42 @@
+# roster.py
+
+class Player:
+    """Ficha de un guerrero. Usa __slots__ para que un cuadro de decenas de miles de jugadores ocupe poca memoria."""
+    __slots__ = ("user_id", "user_name", "character_name", "specialty", "absurd_skill", "is_champion")
+
+    def __init__(self, user_id, user_name, character_name, specialty, absurd_skill, is_champion):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.character_name = character_name
+        self.specialty = specialty
+        self.is_champion = is_champion
+        self.absurd_skill = absurd_skill
+
+    def mention(self):
+        return f"@{self.user_name}" if self.user_name else self.character_name
+
+class Roster:
+    """Guerreros de un torneo indexados por `user_id`, con la lista ordenada de los que siguen en pie."""
+    def __init__(self):
+        self.by_id = {}
+        self.active = []
+
+    def load(self, player_rows):
+        """Crea una ficha por fila (user_id, user_name, character_name, specialty, absurd_skill, is_champion, ...)."""
+        self.by_id = {row[0]: Player(row[0], row[1], row[2], row[3], row[4], row[5]) for row in player_rows}
+        self.set_active(self.by_id[user_id] for user_id in sorted(self.by_id))
+
+    def set_active(self, players):
+        """Fija los guerreros que siguen en pie (en orden), en O(n)."""
+        self.active = list(players)
+
+    def restore_active(self, user_ids):
+        """Fija los guerreros en pie a partir de sus `user_id`."""
+        self.set_active(self.by_id[user_id] for user_id in user_ids)
+
+    def __len__(self):
+        return len(self.active)
+
+    def clear(self):
+        self.by_id = {}
+        self.active = []
@@ -0,0 +1,197 @@
+# scheduler.py
+import asyncio
+import functools
+from collections import OrderedDict, deque
+
+class FairSemaphore:
+    """Semáforo compartido que reparte los huecos por turnos entre inquilinos (torneos).
+
+    Mientras haya espera, cada hueco que se libera pasa al siguiente inquilino de la
+    rueda: un torneo con muchas narraciones pendientes no deja sin Gemini a los demás.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self._in_use = 0
+        # inquilino -> cola de futuros; el orden del diccionario es la rueda.
+        self._waiters = OrderedDict()
+
+    async def acquire(self, key):
+        if self._in_use < self.limit and not self._waiters:
+            self._in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # El hueco llegó justo al cancelarse: se devuelve.
+                self.release()
+            else:
+                _discard(self._waiters, key, future)
+            raise
+
+    def release(self):
+        while self._waiters:
+            future = _next_waiter(self._waiters)
+            if not future.done():
+                # El hueco pasa directamente al siguiente inquilino.
+                future.set_result(None)
+                return
+        self._in_use -= 1
+
+    def tenant(self, key, limit=None):
+        """Huecos de un inquilino, con un tope propio opcional además del compartido."""
+        return TenantSlots(self, key, limit)
+
+class TenantSlots:
+    """Gestor de contexto `async with` que ocupa un hueco del semáforo justo a nombre de un inquilino."""
+    def __init__(self, shared, key, limit=None):
+        self.shared = shared
+        self.key = key
+        self._own = asyncio.Semaphore(limit) if limit else None
+
+    async def __aenter__(self):
+        if self._own:
+            await self._own.acquire()
+        try:
+            await self.shared.acquire(self.key)
+        except BaseException:
+            if self._own:
+                self._own.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.shared.release()
+        if self._own:
+            self._own.release()
+
+class FairRateLimiter:
+    """Cubo de tokens global (el límite de mensajes por segundo de todo el bot) servido por turnos entre colas."""
+    def __init__(self, messages_per_second=30, burst=30):
+        self.rate = messages_per_second
+        self.burst = burst
+        self._tokens = burst
+        self._last_refill = None
+        self._waiters = OrderedDict()
+        self._worker = None
+
+    def _take(self, cost):
+        # Como en Outbox: una operación más cara que la ráfaga deja el cubo en negativo.
+        now = asyncio.get_running_loop().time()
+        if self._last_refill is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if self._tokens >= min(cost, self.burst):
+            self._tokens -= cost
+            return True
+        return False
+
+    async def acquire(self, key, cost=1):
+        """Espera el turno de `key` y los tokens necesarios para `cost` mensajes."""
+        if not self._waiters and self._take(cost):
+            return
+        entry = (asyncio.get_running_loop().create_future(), cost)
+        self._waiters.setdefault(key, deque()).append(entry)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        try:
+            await entry[0]
+        except asyncio.CancelledError:
+            _discard(self._waiters, key, entry)
+            raise
+
+    async def _run(self):
+        while self._waiters:
+            key, queue = next(iter(self._waiters.items()))
+            future, cost = queue[0]
+            if future.done():
+                _discard(self._waiters, key, queue[0])
+                continue
+            if not self._take(cost):
+                await asyncio.sleep((min(cost, self.burst) - self._tokens) / self.rate)
+                continue
+            _next_waiter(self._waiters)[0].set_result(None)
+
+def _next_waiter(waiters):
+    """Saca la primera espera del inquilino en turno y lo manda al final de la rueda."""
+    key, queue = next(iter(waiters.items()))
+    item = queue.popleft()
+    del waiters[key]
+    if queue:
+        waiters[key] = queue
+    return item
+
+def _discard(waiters, key, item):
+    queue = waiters.get(key)
+    if queue is None:
+        return
+    try:
+        queue.remove(item)
+    except ValueError:
+        pass
+    if not queue:
+        del waiters[key]
+
+class ChannelTournament:
+    """Torneo de un canal: su propio Game (plantel, estado, presupuesto de narración) y su cola de salida."""
+    def __init__(self, channel_id, game, outbox):
+        self.channel_id = channel_id
+        self.game = game
+        self.outbox = outbox
+        self.task = None
+
+class TournamentScheduler:
+    """Torneos por canal que se disputan a la vez en el mismo bucle de eventos."""
+    def __init__(self, create_game, create_outbox):
+        self._create_game = create_game
+        self._create_outbox = create_outbox
+        self._tournaments = {}
+        self._bot = None
+
+    def start(self, bot):
+        """Arranca las colas de salida de los torneos ya creados (y de los que se creen después)."""
+        self._bot = bot
+        for tournament in self._tournaments.values():
+            tournament.outbox.start(bot)
+
+    async def stop(self):
+        """Cancela los torneos en curso (quedan sus puntos de control) y detiene sus colas."""
+        tasks = [t.task for t in self._tournaments.values() if t.task and not t.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for tournament in self._tournaments.values():
+            await tournament.outbox.stop()
+        self._bot = None
+
+    def get(self, channel_id):
+        """Devuelve el torneo del canal, creándolo si aún no existe."""
+        tournament = self._tournaments.get(channel_id)
+        if tournament is None:
+            tournament = ChannelTournament(channel_id, self._create_game(channel_id), self._create_outbox(channel_id))
+            if self._bot:
+                tournament.outbox.start(self._bot)
+            self._tournaments[channel_id] = tournament
+        return tournament
+
+    def find(self, channel_id):
+        """Devuelve el torneo del canal, o None si no existe (sin crearlo)."""
+        return self._tournaments.get(channel_id)
+
+    def tournaments(self):
+        return list(self._tournaments.values())
+
+    def open_invocations(self):
+        """Torneos con la convocatoria abierta."""
+        return [t for t in self._tournaments.values() if t.game.is_invocation_open]
+
+    def launch(self, tournament, coro):
+        """Disputa un torneo en segundo plano, sin bloquear al resto."""
+        tournament.task = asyncio.create_task(coro)
+        tournament.task.add_done_callback(functools.partial(_report_failure, tournament.channel_id))
+        return tournament.task
+
+def _report_failure(channel_id, task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error en el torneo del canal {channel_id}: {task.exception()}")
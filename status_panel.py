@@ -0,0 +1,78 @@
+# status_panel.py
+from outbox import MAX_MESSAGE_LENGTH, message_length
+
+ELIMINATED_SUFFIX = " (Eliminado)"
+# Caracteres que añade tachar una línea: "~" + "~" + sufijo.
+STRIKE_OVERHEAD = 2 + len(ELIMINATED_SUFFIX)
+
+class StatusPanel:
+    """Panel de estado de una ronda, con la línea de cada guerrero indexada por `user_id`.
+
+    El listado se reparte en varias páginas (un mensaje anclado por página) que
+    no superan el límite de Telegram, y solo se editan las páginas que cambian.
+    """
+    def __init__(self, players, limit=MAX_MESSAGE_LENGTH):
+        ordered = sorted(players, key=lambda p: p.character_name)
+        self.total = len(ordered)
+        self.pages = []
+        self._position = {}
+        self._dirty = set()
+        self.messages = []
+        self._message_kwargs = {}
+
+        # Se reserva el espacio del tachado para que una página nunca crezca por encima del límite.
+        header_size = message_length(self._header(0, 999)) + 2
+        current = []
+        size = header_size
+        for player in ordered:
+            title = "👑" if player.is_champion else "🔥"
+            line = f"{title} {player.character_name} ({player.mention()})"
+            cost = message_length(line) + 2 + STRIKE_OVERHEAD + 1
+            if current and size + cost > limit:
+                self.pages.append(current)
+                current = []
+                size = header_size
+            self._position[player.user_id] = (len(self.pages), len(current))
+            current.append(f"• {line}")
+            size += cost
+        self.pages.append(current)
+
+    def _header(self, page, page_count):
+        suffix = f" ({page + 1}/{page_count})" if page_count > 1 else ""
+        return f"--- **RONDA CON {self.total} GUERREROS**{suffix} ---"
+
+    def render_page(self, page):
+        """Texto completo de una página."""
+        return self._header(page, len(self.pages)) + "\n\n" + "\n".join(self.pages[page])
+
+    def eliminate(self, player):
+        """Tacha al guerrero eliminado y marca su página como pendiente de edición."""
+        position = self._position.get(player.user_id)
+        if position is None:
+            return
+        page, index = position
+        line = self.pages[page][index]
+        if line.startswith("• ~"):
+            return
+        self.pages[page][index] = f"• ~{line[2:]}~{ELIMINATED_SUFFIX}"
+        self._dirty.add(page)
+
+    async def publish(self, outbox, **kwargs):
+        """Publica y ancla todas las páginas del panel."""
+        self._message_kwargs = kwargs
+        self.messages = []
+        for page in range(len(self.pages)):
+            message = await outbox.send(self.render_page(page), **kwargs)
+            outbox.pin(message)
+            self.messages.append(message)
+
+    def flush(self, outbox):
+        """Encola la edición de las páginas que han cambiado desde la última vez."""
+        for page in sorted(self._dirty):
+            outbox.edit(self.messages[page], self.render_page(page), **self._message_kwargs)
+        self._dirty.clear()
+
+    def unpin(self, outbox):
+        """Desancla las páginas del panel al terminar la ronda."""
+        for message in self.messages:
+            outbox.unpin(message)
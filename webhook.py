@@ -0,0 +1,88 @@
+# webhook.py
+import asyncio
+import hmac
+import json
+
+from telegram import Update
+
+MAX_BODY_SIZE = 1 << 20
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+class WebhookServer:
+    """Servidor HTTP mínimo para recibir las actualizaciones de Telegram por webhook.
+
+    Rutas: POST /<path> (exige la cabecera X-Telegram-Bot-Api-Secret-Token),
+    GET /health (el proceso responde) y GET /ready (el bot terminó de calentarse).
+    Pensado para ir detrás de un proxy que termine el TLS.
+    """
+    def __init__(self, app, path, secret_token, ready_event, listen="0.0.0.0", port=8080):
+        self.app = app
+        self.path = "/" + path.lstrip("/")
+        self.secret_token = secret_token
+        self.ready_event = ready_event
+        self.listen = listen
+        self.port = port
+        self._server = None
+        # Rutas GET adicionales: ruta -> corrutina que devuelve (estado, texto).
+        self.routes = {"/health": self._health, "/ready": self._ready}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _health(self):
+        return 200, "ok"
+
+    async def _ready(self):
+        return (200, "ready") if self.ready_event.is_set() else (503, "warming up")
+
+    async def _receive_update(self, headers, body):
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token, self.secret_token):
+            return 403, "forbidden"
+        update = Update.de_json(json.loads(body), self.app.bot)
+        await self.app.update_queue.put(update)
+        return 200, "ok"
+
+    async def _route(self, method, path, headers, body):
+        if method == "POST" and path == self.path:
+            return await self._receive_update(headers, body)
+        if method == "GET" and path in self.routes:
+            return await self.routes[path]()
+        return 404, "not found"
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_SIZE:
+                status, text = 413, "too large"
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+                status, text = await self._route(method, target.split("?", 1)[0], headers, body)
+        except Exception as e:
+            print(f"Error en una petición al webhook: {e}")
+            status, text = 400, "bad request"
+
+        payload = text.encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                     f"Content-Type: text/plain; charset=utf-8\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()